@@ -0,0 +1,330 @@
+#!/usr/bin/env python3.4
+"""Benchmarks for the site's hot paths against synthetic match corpora.
+
+A corpus of matches is generated for a handful of summoners, each with a
+different number of recurring teammates, and served through fakeriot.py so
+the site runs unmodified without an API key. Summoner pages, team stats,
+match extraction, pool scoring and stats lookups are then timed in process,
+or over HTTP through a locally mounted CherryPy app with --http.
+
+Latency percentiles, throughput and peak RSS are reported for each benchmark.
+Results can be saved as a baseline and later runs compared against it, which
+exits non-zero when a benchmark's median regresses past the tolerance.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import csv
+import importlib.machinery
+import itertools
+import json
+import matchstore
+import matchtable
+import os
+import os.path
+import random
+import resource
+import riot
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import winstats
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHAMPIONS = 130 # synthetic champion ids are 1 through CHAMPIONS
+FOCUS_ID = 1000000 # summoner ids of focus summoners are multiples of this
+LANES = (('TOP', 'SOLO'), ('JUNGLE', 'NONE'), ('MIDDLE', 'SOLO'), ('BOTTOM', 'DUO_CARRY'), ('BOTTOM', 'DUO_SUPPORT'))
+
+
+def make_match(match_id, timestamp, blue, red, rnd):
+    """Return Riot match JSON for the given blue and red team summoner ids."""
+    champions = rnd.sample(range(1, CHAMPIONS + 1), len(blue) + len(red))
+    participants = []
+    identities = []
+    for pid, summoner_id in enumerate(blue + red, 1):
+        lane, role = LANES[(pid - 1) % len(LANES)]
+        participants.append({
+            'participantId': pid,
+            'teamId': 100 if pid <= len(blue) else 200,
+            'championId': champions[pid - 1],
+            'timeline': {'lane': lane, 'role': role},
+        })
+        identities.append({
+            'participantId': pid,
+            'player': {'summonerId': summoner_id, 'summonerName': 'Summoner %d' % summoner_id},
+        })
+    blue_won = rnd.random() < 0.5
+    return {
+        'matchId': match_id,
+        'matchCreation': timestamp,
+        'queueType': 'RANKED_SOLO_5x5',
+        'season': riot.CURRENT_SEASON,
+        'participants': participants,
+        'participantIdentities': identities,
+        'teams': [{'teamId': 100, 'winner': blue_won}, {'teamId': 200, 'winner': not blue_won}],
+    }
+
+
+def make_corpus(focus_id, matches, recurring, premade, population, first_match_id, rnd):
+    """Return matches played by the focus summoner, who queues with each of
+    the given number of recurring teammates with probability premade.
+    """
+    friends = [focus_id + i for i in range(1, recurring + 1)]
+    timestamp = int(time.time() * 1000)
+    corpus = []
+    for match_id in range(first_match_id, first_match_id + matches):
+        team = [focus_id] + [f for f in rnd.sample(friends, len(friends)) if rnd.random() < premade][:4]
+        strangers = rnd.sample(range(1, population + 1), 10 - len(team))
+        blue = team + strangers[:5 - len(team)]
+        red = strangers[5 - len(team):]
+        timestamp -= rnd.randint(20, 60) * 60 * 1000
+        corpus.append(make_match(match_id, timestamp, blue, red, rnd))
+    return corpus
+
+
+def write_stats(data_dir, corpus, rnd):
+    """Write the matchup CSV and win tables the pool and stats pages load."""
+    winner_stats = {}
+    loser_stats = {}
+    for match in corpus:
+        winners = [p['championId'] for p in match['participants'] if match['teams'][p['teamId'] // 100 - 1]['winner']]
+        losers = [p['championId'] for p in match['participants'] if not match['teams'][p['teamId'] // 100 - 1]['winner']]
+        for w, l in itertools.product(winners, losers):
+            winner_stats[w, l] = winner_stats.get((w, l), 0) + 1
+            loser_stats[l, w] = loser_stats.get((l, w), 0) + 1
+    with open(os.path.join(data_dir, 'matchup_stats.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        for key in set(winner_stats).union(loser_stats):
+            writer.writerow(key + (winner_stats.get(key, 0), loser_stats.get(key, 0)))
+
+    shapes = {winstats.KILL_STATS: (40, 40), winstats.TOWER_STATS: (4, 12, 4, 12), winstats.JOINT_STATS: (4, 12, 41, 4, 12, 41)}
+    for spec, shape in shapes.items():
+        name, ndim, caps = spec
+        winner = {}
+        loser = {}
+        for i in range(20000):
+            key = tuple(rnd.randrange(dim) for dim in shape)
+            winner[key] = winner.get(key, 0) + rnd.randint(0, 200)
+            loser[key] = loser.get(key, 0) + rnd.randint(0, 200)
+        winstats.save_table(data_dir, spec, winner, loser)
+    return shapes
+
+
+class FakeRiotThread(threading.Thread):
+    """fakeriot.py serving the corpus on an ephemeral local port."""
+
+    def __init__(self, store_dir, latency):
+        super(FakeRiotThread, self).__init__(name='FakeRiot', daemon=True)
+        self.store_dir = store_dir
+        self.latency = latency
+        self.port = None
+        self.ready = threading.Event()
+
+    def run(self):
+        import fakeriot
+        from aiohttp import web
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        fake = fakeriot.FakeRiot(fakeriot.Corpus(matchstore.MatchStore(self.store_dir)), latency=self.latency, seed=0)
+        app = web.Application(loop=loop)
+        fake.routes(app)
+        server = loop.run_until_complete(loop.create_server(app.make_handler(), '127.0.0.1', 0))
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        loop.run_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in megabytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure(name, fn, args, threads=1):
+    """Call fn once per argument tuple, returning a result dict of latency percentiles in ms."""
+    latencies = []
+
+    def timed(a):
+        start = time.perf_counter()
+        fn(*a)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if threads > 1:
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            latencies = list(executor.map(timed, args))
+    else:
+        latencies = [timed(a) for a in args]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(1000.0 * l for l in latencies)
+    result = {
+        'name': name,
+        'n': len(latencies),
+        'p50': percentile(latencies, 0.50),
+        'p90': percentile(latencies, 0.90),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1],
+        'ops': len(latencies) / elapsed if elapsed else 0.0,
+        'rss': peak_rss_mb(),
+    }
+    print('%-32s %6d %9.2f %9.2f %9.2f %9.2f %9.1f %8.1f' % (
+        name, result['n'], result['p50'], result['p90'], result['p99'], result['max'], result['ops'], result['rss']))
+    return result
+
+
+def load_site():
+    """Import site.py, which stdlib's site module shadows under its own name."""
+    return importlib.machinery.SourceFileLoader('lolfu_site', os.path.join(BASE_DIR, 'site.py')).load_module()
+
+
+def run(args, work_dir):
+    rnd = random.Random(args.seed)
+    data_dir = os.path.join(work_dir, 'data')
+    # the fake Riot API serves the corpus from its own store, the site's starts empty so cold loads fetch every match
+    store_dir = os.path.join(work_dir, 'corpus_store')
+    os.makedirs(data_dir)
+
+    # corpus, one focus summoner per recurring teammate count
+    print('Generating', args.matches, 'matches for each of', len(args.recurring), 'summoners')
+    store = matchstore.MatchStore(store_dir)
+    focus = []
+    corpus = []
+    for i, recurring in enumerate(args.recurring, 1):
+        matches = make_corpus(i * FOCUS_ID, args.matches, recurring, args.premade, args.summoners, len(corpus) + 1, rnd)
+        for match in matches:
+            store.put(match['matchId'], match)
+        corpus.extend(matches)
+        focus.append((recurring, i * FOCUS_ID))
+    store.close()
+    shapes = write_stats(data_dir, corpus, rnd)
+
+    # the site runs unmodified against the fake Riot API
+    fake = FakeRiotThread(store_dir, args.latency)
+    fake.start()
+    fake.ready.wait()
+    cfg_path = os.path.join(work_dir, 'riot.cfg')
+    with open(cfg_path, 'w') as f:
+        f.write('[riot]\napi_key=bench\nrate_limits=1000000:1\nbase_url=http://127.0.0.1:%d\n' % fake.port)
+    riot.RIOT_CFG = cfg_path
+    site = load_site()
+    app = site.Lolfu(data_dir)
+
+    champion_pools = [tuple(rnd.sample(range(1, CHAMPIONS + 1), 3)) for i in range(args.iterations)]
+    joint_states = [tuple(rnd.randrange(dim) for dim in shapes[winstats.JOINT_STATS]) for i in range(args.iterations)]
+
+    print('%-32s %6s %9s %9s %9s %9s %9s %8s' % ('benchmark', 'n', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'ops/s', 'rss MB'))
+    results = []
+    if args.http:
+        import cherrypy
+        import requests
+        port = free_port()
+        cherrypy.config.update({'server.socket_host': '127.0.0.1', 'server.socket_port': port,
+            'server.thread_pool': max(10, args.threads), 'log.screen': False, 'environment': 'production'})
+        cherrypy.tree.mount(app, '/')
+        cherrypy.engine.start()
+        url = 'http://127.0.0.1:%d' % port
+
+        def get(path, **params):
+            requests.get(url + path, params=params).raise_for_status()
+
+        for recurring, summoner_id in focus:
+            results.append(measure('http summoner_content r=%d' % recurring,
+                lambda: get('/summoner_content', summoner_id=summoner_id), [()] * args.iterations, args.threads))
+        results.append(measure('http pool_content', lambda c: get('/pool_content', **{'c%d' % i: cid for (i, cid) in enumerate(c)}),
+            [(c, ) for c in champion_pools], args.threads))
+        results.append(measure('http stats_joint',
+            lambda s: get('/stats_joint', **dict(zip(('youri', 'yourt', 'yourk', 'theiri', 'theirt', 'theirk'), s))),
+            [(s, ) for s in joint_states], args.threads))
+        cherrypy.engine.exit()
+    else:
+        for recurring, summoner_id in focus:
+            results.append(measure('summoner_content cold r=%d' % recurring, app.summoner_content, [(summoner_id, )]))
+            results.append(measure('summoner_content r=%d' % recurring, app.summoner_content, [(summoner_id, )] * args.iterations))
+            stats = app.summoner_stats.get(summoner_id)
+            results.append(measure('teams r=%d' % recurring, app.teams, [(summoner_id, stats)] * args.iterations))
+
+        table = matchtable.MatchTable()
+        rows = [(match['matchId'], table.add(match)) for match in corpus]
+        focus_of = {match['matchId']: match['participantIdentities'][0]['player']['summonerId'] for match in corpus}
+        results.append(measure('Match.__init__', lambda match_id, row: site.Match(app.api, match_id, focus_of[match_id],
+            table, row, {}, {}), rows))
+
+        results.append(measure('pool_content', lambda c: app.pool_content(**{'c%d' % i: cid for (i, cid) in enumerate(c)}),
+            [(c, ) for c in champion_pools]))
+        results.append(measure('stats_joint', app.stats_joint, joint_states))
+
+    print('Peak RSS %.1f MB' % peak_rss_mb())
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print benchmarks whose median regressed past tolerance and return how many did."""
+    regressions = 0
+    for result in results:
+        base = baseline.get(result['name'])
+        if base is None:
+            continue
+        if result['p50'] > base['p50'] * (1.0 + tolerance):
+            regressions += 1
+            print('REGRESSION %s: p50 %.2fms vs baseline %.2fms' % (result['name'], result['p50'], base['p50']))
+    return regressions
+
+
+if __name__ == '__main__':
+    """Run the benchmarks and report, save or compare against a baseline."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--matches', type=int, default=500,
+        help='Matches played by each focus summoner.')
+    parser.add_argument('--recurring', type=int, nargs='+', default=[2, 4, 6, 8, 10],
+        help='Recurring teammate counts, one focus summoner each, to expose team combination growth.')
+    parser.add_argument('--premade', type=float, default=0.3,
+        help='Probability each recurring teammate is in a given match.')
+    parser.add_argument('--summoners', type=int, default=100000,
+        help='Size of the population strangers are drawn from.')
+    parser.add_argument('--iterations', type=int, default=50,
+        help='Calls per benchmark.')
+    parser.add_argument('--latency', type=float, default=0.0,
+        help='Seconds the fake Riot API waits before answering.')
+    parser.add_argument('--http', default=False, action='store_true',
+        help='Drive the CherryPy endpoints over HTTP instead of calling them in process.')
+    parser.add_argument('--threads', type=int, default=1,
+        help='Concurrent clients when benchmarking over HTTP.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=None,
+        help='JSON baseline to compare results against.')
+    parser.add_argument('--save-baseline', default=None,
+        help='Write results as a JSON baseline to this file.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='Allowed fractional p50 slowdown against the baseline.')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='lolfu-bench-')
+    try:
+        results = run(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({r['name']: r for r in results}, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
@@ -0,0 +1,42 @@
+"""Atomic persistence of crawler state.
+
+Files are always written to a temporary file alongside the target and then
+renamed over it, so readers and restarts never see a partially written file.
+"""
+
+import contextlib
+import os
+import os.path
+import pickle
+import tempfile
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode='w', **kw):
+    """Open a temporary file that atomically replaces path once the block exits cleanly."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp-')
+    try:
+        os.chmod(tmp_path, 0o644)
+        with open(fd, mode, **kw) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def load(path):
+    """Return the state saved at path or None if nothing has been saved."""
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save(path, state):
+    """Atomically save the given state to path."""
+    with atomic_open(path, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
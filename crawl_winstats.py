@@ -1,29 +1,30 @@
 #!/usr/bin/env python3.4
 """Utility program to crawl all League of Legends matches outputting
 statistics about wins and losses every minute. Output is formatted
-to CSV files on disk.
+to CSV files and binary win tables in the data directory.
 """
 
-import asyncio
+import checkpoint
+import crawler
 import csv
-import riot
+import itertools
 import os
 import os.path
-import signal
-import sys
+import winstats
 
 
 DATA_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep + 'data'
-MIN_MATCHES = 100 # minimum number of matches to be included in output
+CHECKPOINT_FILE = os.path.join(DATA_DIR, 'winstats_checkpoint.dat')
+METRICS_FILE = os.path.join(DATA_DIR, 'winstats_metrics.prom')
 
 
-class Crawler:
+class WinStats(crawler.Aggregator):
+    """Wins and losses by tower, inhibitor and kill state over each match's timeline."""
 
-    def __init__(self, session, api):
-        self.api = api
-        self.session = session
-        self.matches = {}
-        self.summoners = set()
+    name = 'winstats'
+
+    def __init__(self):
+        super(WinStats, self).__init__()
         self.winner_tower_stats = {}
         self.loser_tower_stats = {}
         self.winner_kill_stats = {}
@@ -31,6 +32,27 @@ class Crawler:
         self.winner_joint_stats = {}
         self.loser_joint_stats = {}
 
+    def status(self):
+        return '%d joint states' % len(self.winner_joint_stats)
+
+    def state(self):
+        return {
+            'winner_tower_stats': dict(self.winner_tower_stats),
+            'loser_tower_stats': dict(self.loser_tower_stats),
+            'winner_kill_stats': dict(self.winner_kill_stats),
+            'loser_kill_stats': dict(self.loser_kill_stats),
+            'winner_joint_stats': dict(self.winner_joint_stats),
+            'loser_joint_stats': dict(self.loser_joint_stats),
+        }
+
+    def restore(self, state):
+        self.winner_tower_stats = state['winner_tower_stats']
+        self.loser_tower_stats = state['loser_tower_stats']
+        self.winner_kill_stats = state['winner_kill_stats']
+        self.loser_kill_stats = state['loser_kill_stats']
+        self.winner_joint_stats = state['winner_joint_stats']
+        self.loser_joint_stats = state['loser_joint_stats']
+
     def update_tower_stats(self, winner_inhibs, winner_towers, loser_inhibs, loser_towers):
         if winner_inhibs > 3 or loser_inhibs > 3:
             raise ValueError('%d inhibitors killed is too many' % max(winner_inhibs, loser_inhibs))
@@ -53,7 +75,7 @@ class Crawler:
         self.loser_joint_stats.setdefault((loser_inhibs, loser_towers, loser_kills, winner_inhibs, winner_towers, winner_kills), 0)
         self.loser_joint_stats[loser_inhibs, loser_towers, loser_kills, winner_inhibs, winner_towers, winner_kills] += 1
 
-    def collect_stats(self, match):
+    def add(self, match):
         winner_towers = 0
         winner_bot_inhib = False
         winner_mid_inhib = False
@@ -156,97 +178,24 @@ class Crawler:
                         #print(event.keys())
                         pass
 
-    @asyncio.coroutine
-    def output(self):
-        while True:
-            print('matches:', len(self.matches), 'observed,', sum(self.matches.values()), 'ok, by', len(self.summoners), 'summoners')
-
-            with open('tower_stats.csv', 'w', newline='') as f:
+    def write_output(self, state):
+        """Write CSV exports and binary tables, each replaced atomically. Both hold
+        every observed state, low counts are smoothed by the tables when served.
+        """
+        for name, winner_stats, loser_stats in (
+                ('tower_stats.csv', state['winner_tower_stats'], state['loser_tower_stats']),
+                ('kill_stats.csv', state['winner_kill_stats'], state['loser_kill_stats']),
+                ('joint_stats.csv', state['winner_joint_stats'], state['loser_joint_stats'])):
+            with checkpoint.atomic_open(os.path.join(DATA_DIR, name), 'w', newline='') as f:
                 writer = csv.writer(f)
-                # tower stats
-                for key in set(self.winner_tower_stats.keys()).union(set(self.loser_tower_stats.keys())):
-                    wins = self.winner_tower_stats.get(key, 0)
-                    losses = self.loser_tower_stats.get(key, 0)
-                    us_inhibs, us_towers, them_inhibs, them_towers = key
-                    if (wins + losses) >= MIN_MATCHES:
-                        writer.writerow((wins, losses, us_inhibs, us_towers, them_inhibs, them_towers))
-
-            with open('kill_stats.csv', 'w', newline='') as f:
-                writer = csv.writer(f)
-                # kill stats
-                for key in set(self.winner_kill_stats.keys()).union(set(self.loser_kill_stats.keys())):
-                    wins = self.winner_kill_stats.get(key, 0)
-                    losses = self.loser_kill_stats.get(key, 0)
-                    us_kills, them_kills = key
-                    if (wins + losses) >= MIN_MATCHES:
-                        writer.writerow((wins, losses, us_kills, them_kills))
-
-            with open('joint_stats.csv', 'w', newline='') as f:
-                writer = csv.writer(f)
-                # joint tower and kill stats
-                for key in set(self.winner_joint_stats.keys()).union(set(self.loser_joint_stats.keys())):
-                    wins = self.winner_joint_stats.get(key, 0)
-                    losses = self.loser_joint_stats.get(key, 0)
-                    us_inhibs, us_towers, us_kills, them_inhibs, them_towers, them_kills = key
-                    if (wins + losses) >= MIN_MATCHES:
-                        writer.writerow((wins, losses, us_inhibs, us_towers, us_kills, them_inhibs, them_towers, them_kills))
-
-            yield from asyncio.sleep(60)
-
-    @asyncio.coroutine
-    def run(self):
-        chunk = 100
-        tasks = []
-
-        i = 0
-        for root, dirs, files in os.walk(os.path.join(DATA_DIR, 'match')):
-            for name in files:
-                i += 1
-                match_id = int(name.split('.')[0]) # format is {match_id}.dat
-                tasks.append(self.add_match(match_id))
-                if not i % chunk:
-                    yield from asyncio.wait(tasks)
-                    tasks.clear()
-        yield from asyncio.wait(tasks)
-        tasks.clear()
-
-        while self.summoners:
-            summoners = list(self.summoners)
-            while summoners:
-                yield from asyncio.wait([self.add_summoner(s) for s in summoners[:chunk]])
-                del summoners[:chunk]
-
-    @asyncio.coroutine
-    def add_match(self, match_id):
-        if match_id not in self.matches:
-            self.matches[match_id] = False
-            try:
-                match = yield from self.api.match_timeline_nocache_async(self.session, match_id)
-            except Exception as e:
-                print('...', match_id, 'has error', repr(str(e)), file=sys.stderr)
-            else:
-                if match is not None:
-                    self.collect_stats(match)
-                    for pid in match['participantIdentities']:
-                        summoner_id = pid['player']['summonerId']
-                        self.summoners.add(summoner_id)
-                    self.matches[match_id] = True
-
-    @asyncio.coroutine
-    def add_summoner(self, summoner_id):
-        for match in (yield from self.api.matchlist_async(self.session, summoner_id)):
-            yield from self.add_match(match['matchId'])
+                for key in itertools.chain(winner_stats, (k for k in loser_stats if k not in winner_stats)):
+                    writer.writerow((winner_stats.get(key, 0), loser_stats.get(key, 0)) + key)
+
+        # binary tables the site loads directly
+        winstats.save_table(DATA_DIR, winstats.TOWER_STATS, state['winner_tower_stats'], state['loser_tower_stats'])
+        winstats.save_table(DATA_DIR, winstats.KILL_STATS, state['winner_kill_stats'], state['loser_kill_stats'])
+        winstats.save_table(DATA_DIR, winstats.JOINT_STATS, state['winner_joint_stats'], state['loser_joint_stats'])
 
 
 if __name__ == '__main__':
-    session = riot.ClientSession()
-    try:
-        loop = asyncio.get_event_loop()
-        loop.add_signal_handler(signal.SIGINT, loop.stop)
-        loop.add_signal_handler(signal.SIGTERM, loop.stop)
-        crawler = Crawler(session, riot.RiotAPI(None, DATA_DIR))
-        loop.create_task(crawler.output())
-        loop.create_task(crawler.run())
-        loop.run_forever()
-    finally:
-        session.close()
+    crawler.main([WinStats()], CHECKPOINT_FILE, METRICS_FILE)
@@ -0,0 +1,247 @@
+"""Single-pass League of Legends match crawler.
+
+The crawler walks summoners breadth first and fetches each match exactly once,
+with its timeline, handing it to every registered aggregator. Aggregators keep
+their own counters and output, so collecting a new statistic means adding an
+aggregator rather than another full crawl of the ladder.
+"""
+
+import abc
+import asyncio
+import checkpoint
+import frontier
+import metrics
+import riot
+import os
+import os.path
+import signal
+import sys
+import time
+
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep + 'data'
+OUTPUT_SECONDS = 60 # how often aggregator output and the checkpoint are written
+IDLE_SECONDS = 60 # how long to wait for visited summoners to come due once the frontier runs dry
+WORKERS = riot.ClientSession.MAX_CONCURRENCY # enough concurrent jobs to keep every API request slot busy
+
+MATCHES = metrics.Counter('lolfu_crawler_matches_total', 'Matches the crawler attempted by result.', ('result', ))
+JOB_SECONDS = metrics.Histogram('lolfu_crawler_job_seconds', 'Time crawler workers spend on each job.', ('job', ))
+
+
+class Aggregator(abc.ABC):
+    """Statistics collected from crawled matches. Subclasses set name, the key
+    of their state within the crawler checkpoint, and implement add.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.generation = 0 # bumped by the crawler whenever a match is folded in
+
+    @abc.abstractmethod
+    def add(self, match):
+        """Fold the given Riot match JSON, including its timeline, into the counters."""
+
+    def status(self):
+        """Return a short description of the counters for progress output."""
+        return self.name
+
+    def state(self):
+        """Return a snapshot of the counters safe to hand to another thread."""
+        return {}
+
+    def restore(self, state):
+        """Resume from a snapshot previously returned by state."""
+        pass
+
+    def write_output(self, state):
+        """Write output for the given snapshot. Runs off the event loop."""
+        pass
+
+
+class SummonerDiscovery(Aggregator):
+    """Summoners seen in crawled matches, queued for the crawler to visit their matchlists."""
+
+    name = 'summoners'
+
+    def __init__(self):
+        super(SummonerDiscovery, self).__init__()
+        self.frontier = frontier.Frontier()
+
+    def add(self, match):
+        for pid in match['participantIdentities']:
+            player = pid.get('player')
+            if player:
+                self.frontier.push(player['summonerId'])
+
+    def status(self):
+        return '%d summoners queued' % len(self.frontier)
+
+    def state(self):
+        return {'frontier': self.frontier.state()}
+
+    def restore(self, state):
+        self.frontier.restore(state['frontier'])
+
+
+class Crawler:
+
+    def __init__(self, session, api, aggregators, checkpoint_file, metrics_file=None, workers=WORKERS):
+        self.api = api
+        self.session = session
+        self.workers = workers
+        self.checkpoint_file = checkpoint_file
+        self.metrics_file = metrics_file
+        self.queue = None
+        self.matches = frontier.IdSet() # every match folded into the aggregators
+        self.failed = frontier.IdSet() # matches that failed this run, retried after a restart
+        self.fetching = set()
+        self.discovery = SummonerDiscovery()
+        self.aggregators = [self.discovery] + list(aggregators)
+        self.restore()
+        metrics.REGISTRY.collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        yield ('lolfu_crawler_frontier_summoners', 'gauge', 'Summoners queued to be visited.',
+            [({}, len(self.discovery.frontier))])
+        yield ('lolfu_crawler_queue_jobs', 'gauge', 'Jobs waiting for a crawler worker.',
+            [({}, self.queue.qsize() if self.queue is not None else 0)])
+        yield ('lolfu_crawler_aggregated_matches', 'gauge', 'Matches folded into each aggregator since it was restored.',
+            [({'aggregator': a.name}, a.generation) for a in self.aggregators])
+
+    def restore(self):
+        """Resume from the last checkpoint, if any."""
+        state = checkpoint.load(self.checkpoint_file)
+        if state:
+            self.matches = state['matches']
+            for aggregator in self.aggregators:
+                if aggregator.name in state['aggregators']:
+                    aggregator.restore(state['aggregators'][aggregator.name])
+
+    def state(self):
+        """Return a snapshot of processed matches and every aggregator's counters."""
+        return {
+            'matches': self.matches.copy(),
+            'aggregators': {a.name: a.state() for a in self.aggregators},
+        }
+
+    def checkpoint(self):
+        """Persist processed matches and counters so a restart only folds in new matches."""
+        checkpoint.save(self.checkpoint_file, self.state())
+
+    @asyncio.coroutine
+    def output(self):
+        generations = [a.generation for a in self.aggregators]
+        while True:
+            yield from asyncio.sleep(OUTPUT_SECONDS)
+            print('matches:', len(self.matches), 'ok,', len(self.failed), 'failed,',
+                ', '.join(a.status() for a in self.aggregators))
+
+            # only aggregators that folded in a match since the last output are rewritten
+            current = [a.generation for a in self.aggregators]
+            dirty = [a for (a, g, last) in zip(self.aggregators, current, generations) if g != last]
+            generations = current
+            yield from asyncio.get_event_loop().run_in_executor(None, self.write_output,
+                dirty, self.state() if dirty else None, metrics.REGISTRY.render())
+
+    def write_output(self, aggregators, state, metrics_text):
+        for aggregator in aggregators:
+            aggregator.write_output(state['aggregators'][aggregator.name])
+        if state is not None:
+            checkpoint.save(self.checkpoint_file, state)
+        if self.metrics_file:
+            # a dump for the Prometheus node exporter's textfile collector
+            with checkpoint.atomic_open(self.metrics_file) as f:
+                f.write(metrics_text)
+
+    @asyncio.coroutine
+    def run(self):
+        """Crawl stored matches, then the summoner frontier, with a fixed pool of
+        workers pulling from a bounded queue. A slow match or a rate limit backoff
+        only holds up its own worker while the rest keep the API busy. Runs until
+        cancelled, since visited summoners come due for another visit.
+        """
+        queue = self.queue = asyncio.Queue(maxsize=self.workers)
+        loop = asyncio.get_event_loop()
+        workers = [loop.create_task(self.worker(queue)) for i in range(self.workers)]
+        try:
+            for match_id in self.api.match_store.match_ids():
+                yield from queue.put((self.add_match, match_id))
+
+            while True:
+                summoner_id = self.discovery.frontier.pop()
+                if summoner_id is None:
+                    # in-flight work may yet discover more summoners
+                    yield from queue.join()
+                    summoner_id = self.discovery.frontier.pop()
+                    if summoner_id is None:
+                        yield from asyncio.sleep(IDLE_SECONDS)
+                        continue
+                yield from queue.put((self.add_summoner, summoner_id))
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    @asyncio.coroutine
+    def worker(self, queue):
+        while True:
+            job, id = yield from queue.get()
+            start = time.time()
+            try:
+                yield from job(id)
+            except Exception as e:
+                print('...', id, 'has error', repr(str(e)), file=sys.stderr)
+            finally:
+                JOB_SECONDS.observe(time.time() - start, job.__name__)
+                queue.task_done()
+
+    @asyncio.coroutine
+    def add_match(self, match_id):
+        if match_id in self.matches or match_id in self.failed or match_id in self.fetching:
+            return
+        self.fetching.add(match_id)
+        try:
+            match = yield from self.api.match_timeline_nocache_async(self.session, match_id)
+        except Exception as e:
+            MATCHES.inc('error')
+            self.failed.add(match_id)
+            print('...', match_id, 'has error', repr(str(e)), file=sys.stderr)
+        else:
+            MATCHES.inc('ok' if match is not None else 'missing')
+            if match is None:
+                self.failed.add(match_id)
+            else:
+                if match_id not in self.api.match_store:
+                    # the store holds matches as the site fetches them, without timelines
+                    self.api.match_store.put(match_id, {k: v for (k, v) in match.items() if k != 'timeline'})
+                for aggregator in self.aggregators:
+                    try:
+                        aggregator.add(match)
+                    except Exception as e:
+                        print('...', match_id, aggregator.name, 'has error', repr(str(e)), file=sys.stderr)
+                    else:
+                        aggregator.generation += 1
+                self.matches.add(match_id)
+        finally:
+            self.fetching.discard(match_id)
+
+    @asyncio.coroutine
+    def add_summoner(self, summoner_id):
+        for match in (yield from self.api.matchlist_async(self.session, summoner_id)):
+            yield from self.add_match(match['matchId'])
+
+
+def main(aggregators, checkpoint_file, metrics_file=None, logger=None):
+    """Crawl until interrupted, feeding every match to the given aggregators."""
+    session = riot.ClientSession()
+    try:
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGINT, loop.stop)
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+        crawler = Crawler(session, riot.RiotAPI(logger, DATA_DIR), aggregators, checkpoint_file, metrics_file)
+        loop.create_task(crawler.output())
+        loop.create_task(crawler.run())
+        loop.run_forever()
+        crawler.checkpoint()
+    finally:
+        session.close()
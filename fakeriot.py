@@ -0,0 +1,292 @@
+#!/usr/bin/env python3.4
+"""Local stand-in for the Riot API serving a recorded corpus of matches.
+
+Matches are served from a match store, and matchlists and summoner lookups
+are derived from the participants of those matches. Responses can be delayed
+and a fraction of requests answered with 429s or 5xxs, so crawl throughput,
+retry behavior and site latency can be measured reproducibly without an API
+key. Point riot.cfg's base_url at the address this serves on.
+
+Match stores written by the site and crawler hold matches without their
+timelines. Replaying a crawl needs timelines for the tower and kill stats, so
+they are served from --timeline-store-dir when it holds the match, and are
+otherwise synthesized from each match's kill and building totals.
+"""
+
+import argparse
+import asyncio
+import json
+import matchstore
+import os.path
+import random
+import signal
+import time
+
+from aiohttp import web
+
+
+LANES = ('TOP_LANE', 'MID_LANE', 'BOT_LANE')
+TOWER_TYPES = ('OUTER_TURRET', 'INNER_TURRET', 'BASE_TURRET', 'NEXUS_TURRET')
+
+
+def synthesize_timeline(match):
+    """Return a timeline of champion and building kills consistent with the
+    match's team totals, randomized but the same every time for a match.
+    """
+    rnd = random.Random(match['matchId'])
+    duration = max(600, match.get('matchDuration', 1800)) * 1000
+    participants = match.get('participants', [])
+    events = []
+    for team in match.get('teams', []):
+        team_id = team['teamId']
+        won = bool(team.get('winner'))
+        members = [p for p in participants if p['teamId'] == team_id]
+        enemies = [p for p in participants if p['teamId'] != team_id]
+        if not members or not enemies:
+            continue
+        kills = sum(p.get('stats', {}).get('kills', 0) for p in members)
+        if not kills and not any('stats' in p for p in members):
+            kills = rnd.randint(15, 35) if won else rnd.randint(5, 25)
+        towers = min(11, team.get('towerKills', rnd.randint(6, 11) if won else rnd.randint(0, 5)))
+        inhibitors = min(3, team.get('inhibitorKills', rnd.randint(1, 3) if won else 0))
+        enemy_team_id = enemies[0]['teamId']
+        for i in range(kills):
+            events.append({'eventType': 'CHAMPION_KILL', 'timestamp': rnd.randint(60000, duration),
+                'killerId': rnd.choice(members)['participantId'], 'victimId': rnd.choice(enemies)['participantId']})
+        for i in range(towers):
+            # buildings are attributed to the team that owned them
+            events.append({'eventType': 'BUILDING_KILL', 'timestamp': rnd.randint(300000, duration),
+                'teamId': enemy_team_id, 'buildingType': 'TOWER_BUILDING', 'laneType': rnd.choice(LANES),
+                'towerType': TOWER_TYPES[min(i // 3, len(TOWER_TYPES) - 1)]})
+        for lane in rnd.sample(LANES, inhibitors):
+            events.append({'eventType': 'BUILDING_KILL', 'timestamp': rnd.randint(duration // 2, duration),
+                'teamId': enemy_team_id, 'buildingType': 'INHIBITOR_BUILDING', 'laneType': lane,
+                'towerType': 'UNDEFINED_TURRET'})
+    events.sort(key=lambda e: e['timestamp'])
+    frames = {}
+    for event in events:
+        frames.setdefault(event['timestamp'] // 60000, []).append(event)
+    return {'frameInterval': 60000, 'frames': [{'timestamp': minute * 60000, 'events': frames.get(minute, [])}
+        for minute in range(duration // 60000 + 1)]}
+
+
+def standardize(name):
+    """Return the summoner name the way Riot keys summoner lookups."""
+    return name.lower().replace(' ', '')
+
+
+class Corpus:
+    """Matchlists, summoners and champions indexed from every match in a store."""
+
+    def __init__(self, store, timeline_store=None):
+        self.store = store
+        self.timeline_store = timeline_store
+        self.matchlists = {} # summoner_id -> matchlist entries, newest first
+        self.summoners = {} # standardized name -> summoner
+        self.champion_ids = set()
+        for i, match_id in enumerate(store.match_ids(), 1):
+            self.add(store.get(match_id))
+            if not i % 10000:
+                print('Indexed', i, 'matches')
+        for matchlist in self.matchlists.values():
+            matchlist.sort(key=lambda m: m['timestamp'], reverse=True)
+
+    def add(self, match):
+        participants = {p['participantId']: p for p in match.get('participants', [])}
+        for pid in match.get('participantIdentities', []):
+            player = pid.get('player')
+            participant = participants.get(pid['participantId'])
+            if not player or not participant:
+                continue
+            timeline = participant.get('timeline', {})
+            self.matchlists.setdefault(player['summonerId'], []).append({
+                'matchId': match['matchId'],
+                'timestamp': match.get('matchCreation', 0),
+                'champion': participant['championId'],
+                'lane': timeline.get('lane'),
+                'role': timeline.get('role'),
+                'queue': match.get('queueType'),
+                'season': match.get('season'),
+                'platformId': match.get('platformId'),
+                'region': match.get('region'),
+            })
+            self.summoners[standardize(player['summonerName'])] = {
+                'id': player['summonerId'],
+                'name': player['summonerName'],
+                'profileIconId': player.get('profileIcon', 0),
+                'summonerLevel': 30,
+                'revisionDate': match.get('matchCreation', 0),
+            }
+            self.champion_ids.add(participant['championId'])
+
+    def match(self, match_id, timeline=False):
+        """Return the stored match, with a recorded or synthesized timeline if asked for, or None."""
+        if timeline and self.timeline_store is not None:
+            match = self.timeline_store.get(match_id)
+            if match is not None:
+                return match
+        match = self.store.get(match_id)
+        if match is None:
+            return None
+        if not timeline:
+            return {k: v for (k, v) in match.items() if k != 'timeline'}
+        if 'timeline' not in match:
+            match['timeline'] = synthesize_timeline(match)
+        return match
+
+    def champions(self):
+        return {'type': 'champion', 'data': {str(cid): {
+            'id': cid,
+            'key': 'Champion%d' % cid,
+            'name': 'Champion %d' % cid,
+            'image': {'full': 'Champion%d.png' % cid},
+        } for cid in self.champion_ids}}
+
+
+class FakeRiot:
+    """Request handlers answering from a corpus with injected latency and failures."""
+
+    def __init__(self, corpus, latency=0.0, jitter=0.0, error_429=0.0, error_5xx=0.0, retry_after=1, seed=None):
+        self.corpus = corpus
+        self.latency = latency
+        self.jitter = jitter
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.counts = {}
+
+    def routes(self, app):
+        app.router.add_route('GET', '/api/lol/na/v2.2/match/{match_id}', self.match)
+        app.router.add_route('GET', '/api/lol/na/v2.2/matchlist/by-summoner/{summoner_id}', self.matchlist)
+        app.router.add_route('GET', '/api/lol/na/v1.4/summoner/by-name/{names}', self.summoner_by_name)
+        app.router.add_route('GET', '/api/lol/static-data/na/v1.2/champion', self.champions)
+
+    def count(self, status):
+        self.counts[status] = self.counts.get(status, 0) + 1
+
+    def respond(self, result, status=200, headers=None):
+        self.count(status)
+        headers = dict(headers or {})
+        headers['Content-Type'] = 'application/json;charset=utf-8'
+        body = json.dumps(result).encode('utf-8') if result is not None else b''
+        return web.Response(body=body, status=status, headers=headers)
+
+    @asyncio.coroutine
+    def delay(self):
+        """Sleep for the injected latency, then return an error response to send instead, if any."""
+        seconds = self.random.gauss(self.latency, self.jitter) if self.jitter else self.latency
+        if seconds > 0:
+            yield from asyncio.sleep(seconds)
+        roll = self.random.random()
+        if roll < self.error_429:
+            return self.respond({'status': {'message': 'Rate limit exceeded', 'status_code': 429}}, 429,
+                {'Retry-After': str(self.retry_after), 'X-Rate-Limit-Type': 'user'})
+        if roll < self.error_429 + self.error_5xx:
+            status = self.random.choice((500, 503))
+            return self.respond({'status': {'message': 'Service unavailable', 'status_code': status}}, status)
+        return None
+
+    @asyncio.coroutine
+    def match(self, request):
+        error = yield from self.delay()
+        if error:
+            return error
+        match = self.corpus.match(int(request.match_info['match_id']), request.GET.get('includeTimeline') == 'true')
+        if match is None:
+            return self.respond(None, 404)
+        return self.respond(match)
+
+    @asyncio.coroutine
+    def matchlist(self, request):
+        error = yield from self.delay()
+        if error:
+            return error
+        matchlist = self.corpus.matchlists.get(int(request.match_info['summoner_id']))
+        if matchlist is None:
+            return self.respond(None, 404)
+        begin_time = int(request.GET.get('beginTime', 0))
+        end_time = int(request.GET.get('endTime', 1 << 62))
+        matches = [m for m in matchlist if begin_time <= m['timestamp'] < end_time]
+        total = len(matches)
+        begin_index = int(request.GET.get('beginIndex', 0))
+        end_index = int(request.GET.get('endIndex', total))
+        matches = matches[begin_index:end_index]
+        return self.respond({
+            'matches': matches,
+            'totalGames': total,
+            'startIndex': begin_index,
+            'endIndex': begin_index + len(matches),
+        })
+
+    @asyncio.coroutine
+    def summoner_by_name(self, request):
+        error = yield from self.delay()
+        if error:
+            return error
+        result = {}
+        for name in request.match_info['names'].split(','):
+            summoner = self.corpus.summoners.get(standardize(name))
+            if summoner:
+                result[standardize(name)] = summoner
+        if not result:
+            return self.respond(None, 404)
+        return self.respond(result)
+
+    @asyncio.coroutine
+    def champions(self, request):
+        error = yield from self.delay()
+        if error:
+            return error
+        return self.respond(self.corpus.champions())
+
+
+if __name__ == '__main__':
+    """Serve a recorded match store as the Riot API until interrupted."""
+
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + os.sep + 'data'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store-dir', default=os.path.join(data_dir, 'match_store'),
+        help='Match store to serve.')
+    parser.add_argument('--timeline-store-dir', default=None,
+        help='Match store holding matches with timelines to serve to crawlers, synthesized when missing.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05,
+        help='Mean seconds to wait before answering each request.')
+    parser.add_argument('--jitter', type=float, default=0.0,
+        help='Standard deviation of the latency in seconds.')
+    parser.add_argument('--error-429', type=float, default=0.0,
+        help='Fraction of requests answered with 429 Rate Limit Exceeded.')
+    parser.add_argument('--error-5xx', type=float, default=0.0,
+        help='Fraction of requests answered with 500 or 503.')
+    parser.add_argument('--retry-after', type=int, default=1,
+        help='Retry-After seconds sent with each 429.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed so latency and failures replay identically.')
+    args = parser.parse_args()
+
+    store = matchstore.MatchStore(args.store_dir)
+    start = time.time()
+    timeline_store = matchstore.MatchStore(args.timeline_store_dir) if args.timeline_store_dir else None
+    corpus = Corpus(store, timeline_store)
+    print('Indexed', len(store), 'matches,', len(corpus.matchlists), 'summoners in %.1fs' % (time.time() - start))
+
+    fake = FakeRiot(corpus, args.latency, args.jitter, args.error_429, args.error_5xx, args.retry_after, args.seed)
+    loop = asyncio.get_event_loop()
+    app = web.Application(loop=loop)
+    fake.routes(app)
+    handler = app.make_handler()
+    server = loop.run_until_complete(loop.create_server(handler, args.host, args.port))
+    loop.add_signal_handler(signal.SIGINT, loop.stop)
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    print('Serving on http://%s:%d' % (args.host, args.port))
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        store.close()
+        if timeline_store is not None:
+            timeline_store.close()
+        print('Responses by status:', ', '.join('%d: %d' % item for item in sorted(fake.counts.items())))
@@ -0,0 +1,139 @@
+"""Bounded memory bookkeeping for crawling the summoner graph.
+
+Crawls run for weeks, so sets of everything ever seen can't be Python sets
+and dicts. Match ids are held in sorted arrays at 8 bytes apiece, and the
+summoner frontier is a capped FIFO that only remembers recent visits.
+"""
+
+import array
+import bisect
+import collections
+import heapq
+import time
+
+
+FRONTIER_SIZE = 100000 # most summoners waiting to be visited, more are dropped until rediscovered
+REFRESH_SECONDS = 24 * 60 * 60 # never revisit a summoner sooner than this
+
+
+class IdSet:
+    """Add-only set of 64-bit integer ids held in a sorted array, with recent
+    additions kept in a small set that is merged in once it fills up.
+    """
+
+    MERGE_SIZE = 65536
+
+    def __init__(self, ids=()):
+        self.ids = array.array('q', sorted(set(ids)))
+        self.pending = set()
+
+    def __contains__(self, id):
+        if id in self.pending:
+            return True
+        i = bisect.bisect_left(self.ids, id)
+        return i < len(self.ids) and self.ids[i] == id
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    def __iter__(self):
+        self.merge()
+        return iter(self.ids)
+
+    def add(self, id):
+        if id not in self:
+            self.pending.add(id)
+            if len(self.pending) >= self.MERGE_SIZE:
+                self.merge()
+
+    def merge(self):
+        """Fold pending additions into the sorted array."""
+        if self.pending:
+            self.ids = array.array('q', heapq.merge(self.ids, sorted(self.pending)))
+            self.pending.clear()
+
+    def copy(self):
+        self.merge()
+        copy = IdSet()
+        copy.ids = array.array('q', self.ids)
+        return copy
+
+
+class Frontier:
+    """FIFO queue of summoners to visit.
+
+    At most max_size summoners wait in the queue; newly discovered summoners
+    are dropped while it is full and picked up again when rediscovered.
+    Summoners visited within the last refresh window are never queued. Visits
+    are remembered in two rotating windows, so memory is bounded by the visit
+    rate rather than by the number of summoners on the ladder. Summoners whose
+    visit rotates out of both windows are queued again, so their new matches
+    keep being crawled.
+    """
+
+    def __init__(self, max_size=FRONTIER_SIZE, refresh_seconds=REFRESH_SECONDS):
+        self.max_size = max_size
+        self.refresh_seconds = refresh_seconds
+        self.queue = collections.deque()
+        self.queued = set()
+        self.visited = IdSet() # visited in the current window
+        self.previous = IdSet() # visited in the previous window
+        self.expired = array.array('q') # visited before the previous window, due to be queued again
+        self.window_start = time.time()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def recent(self, summoner_id):
+        """Return whether the given summoner was visited within the refresh window."""
+        return summoner_id in self.visited or summoner_id in self.previous
+
+    def rotate(self):
+        now = time.time()
+        if now - self.window_start >= self.refresh_seconds:
+            self.expired.extend(self.previous)
+            if now - self.window_start >= 2 * self.refresh_seconds:
+                self.expired.extend(self.visited)
+                self.previous = IdSet()
+            else:
+                self.previous = self.visited
+            self.visited = IdSet()
+            self.window_start = now
+
+    def push(self, summoner_id):
+        """Queue the given summoner and return whether it was queued."""
+        if summoner_id in self.queued or len(self.queue) >= self.max_size or self.recent(summoner_id):
+            return False
+        self.queue.append(summoner_id)
+        self.queued.add(summoner_id)
+        return True
+
+    def pop(self):
+        """Return the next summoner to visit, marking it visited, or None if the queue is empty."""
+        self.rotate()
+        while self.expired and len(self.queue) < self.max_size:
+            self.push(self.expired.pop())
+        if not self.queue:
+            return None
+        summoner_id = self.queue.popleft()
+        self.queued.discard(summoner_id)
+        self.visited.add(summoner_id)
+        return summoner_id
+
+    def state(self):
+        """Return a snapshot safe to hand to another thread."""
+        return {
+            'queue': array.array('q', self.queue),
+            'visited': self.visited.copy(),
+            'previous': self.previous.copy(),
+            'expired': array.array('q', self.expired),
+            'window_start': self.window_start,
+        }
+
+    def restore(self, state):
+        self.queue = collections.deque(state['queue'])
+        self.queued = set(self.queue)
+        self.visited = state['visited']
+        self.previous = state['previous']
+        self.expired = state['expired']
+        self.window_start = state['window_start']
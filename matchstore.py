@@ -0,0 +1,186 @@
+#!/usr/bin/env python3.4
+"""Packed, append-only match store.
+
+Matches are stored as JSON records packed back to back in large segment
+files. An append-only index file maps each match id to its segment, offset
+and length. The index is held in memory so lookups never touch the
+filesystem, and records are read through memory maps of the segments.
+
+Run this module directly to migrate a legacy one-file-per-match cache tree
+into a store.
+"""
+
+import argparse
+import fcntl
+import json
+import mmap
+import os
+import os.path
+import struct
+import threading
+
+
+INDEX_FILE = 'index.dat'
+INDEX_ENTRY = struct.Struct('<qIQI') # match_id, segment, offset, length
+SEGMENT_FILE = 'segment-%04d.dat'
+SEGMENT_SIZE = 1 << 30 # roll over to a new segment after 1GB
+
+
+class MatchStore:
+    """Append-only store of match JSON keyed by match id. Safe to share
+    between threads, and between processes appending to the same directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.RLock()
+        self.index = {}
+        self.index_offset = 0
+        self.segment = 0 # newest segment and the end of its last indexed record
+        self.segment_end = 0
+        self.index_file = open(os.path.join(directory, INDEX_FILE), 'a+b')
+        self.maps = {}
+        self.refresh()
+
+    def __contains__(self, match_id):
+        if match_id in self.index:
+            return True
+        self.refresh()
+        return match_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def match_ids(self):
+        """Return all match ids currently in the store."""
+        self.refresh()
+        with self.lock:
+            return list(self.index)
+
+    def refresh(self):
+        """Read index entries appended since we last looked, possibly by other processes."""
+        with self.lock:
+            size = os.fstat(self.index_file.fileno()).st_size
+            size -= (size - self.index_offset) % INDEX_ENTRY.size # ignore a partially written entry
+            if size <= self.index_offset:
+                return
+            self.index_file.seek(self.index_offset)
+            data = self.index_file.read(size - self.index_offset)
+            for match_id, segment, offset, length in INDEX_ENTRY.iter_unpack(data):
+                self.index[match_id] = (segment, offset, length)
+                if segment > self.segment:
+                    self.segment, self.segment_end = segment, offset + length
+                elif segment == self.segment:
+                    self.segment_end = max(self.segment_end, offset + length)
+            self.index_offset = size
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, SEGMENT_FILE % segment)
+
+    def segment_map(self, segment, end):
+        """Return a memory map of the given segment covering at least end bytes."""
+        m = self.maps.get(segment)
+        if m is None or len(m) < end:
+            if m is not None:
+                m.close()
+            with open(self.segment_path(segment), 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = m
+        return m
+
+    def size(self, match_id):
+        """Return the stored size in bytes of the given match or None if it isn't stored."""
+        location = self.index.get(match_id)
+        return location[2] if location is not None else None
+
+    def get(self, match_id):
+        """Return the stored match or None if it isn't stored."""
+        location = self.index.get(match_id)
+        if location is None:
+            self.refresh()
+            location = self.index.get(match_id)
+            if location is None:
+                return None
+        segment, offset, length = location
+        with self.lock:
+            data = self.segment_map(segment, offset + length)[offset:offset + length]
+        return json.loads(data.decode('utf-8'))
+
+    def put(self, match_id, match):
+        """Append the given match to the store unless it is already stored."""
+        data = json.dumps(match, separators=(',', ':')).encode('utf-8')
+        with self.lock:
+            fcntl.flock(self.index_file.fileno(), fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                if match_id in self.index:
+                    return # okay if some other process has already stored this
+                segment = self.segment
+                if self.segment_end >= SEGMENT_SIZE:
+                    segment += 1
+                path = self.segment_path(segment)
+                # the record is written before the index points at it, so other processes
+                # never look it up early; neither is fsynced, a host crash may lose recent matches
+                with open(path, 'ab') as f:
+                    offset = f.tell()
+                    f.write(data)
+                # drop an entry left partially written by a crashed writer so ours stays aligned
+                size = os.fstat(self.index_file.fileno()).st_size
+                if size % INDEX_ENTRY.size:
+                    os.ftruncate(self.index_file.fileno(), size - size % INDEX_ENTRY.size)
+                self.index_file.seek(0, os.SEEK_END)
+                self.index_file.write(INDEX_ENTRY.pack(match_id, segment, offset, len(data)))
+                self.index_file.flush()
+                self.refresh()
+            finally:
+                fcntl.flock(self.index_file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        with self.lock:
+            for m in self.maps.values():
+                m.close()
+            self.maps.clear()
+            self.index_file.close()
+
+
+def migrate(cache_dir, store):
+    """Copy every match from a legacy one-file-per-match cache tree into the store."""
+    migrated = 0
+    for root, dirs, files in os.walk(cache_dir):
+        for name in files:
+            if not name.endswith('.dat'):
+                continue
+            match_id = int(name.split('.')[0]) # format is {match_id}.dat
+            if match_id in store:
+                continue
+            try:
+                with open(os.path.join(root, name), 'r') as f:
+                    match = json.load(f)
+            except ValueError as e:
+                print('...', match_id, 'has error', repr(str(e)))
+                continue
+            store.put(match_id, match)
+            migrated += 1
+            if not migrated % 10000:
+                print('Migrated', migrated, 'matches')
+    return migrated
+
+
+if __name__ == '__main__':
+    """Migrate a legacy match cache tree into a match store."""
+
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + os.sep + 'data'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-dir', default=os.path.join(data_dir, 'match'),
+        help='Legacy match cache tree to migrate from.')
+    parser.add_argument('--store-dir', default=os.path.join(data_dir, 'match_store'),
+        help='Match store to migrate into.')
+    args = parser.parse_args()
+
+    store = MatchStore(args.store_dir)
+    try:
+        print('Migrated', migrate(args.cache_dir, store), 'matches,', len(store), 'now stored')
+    finally:
+        store.close()
@@ -0,0 +1,118 @@
+"""Compact columnar representation of League of Legends matches.
+
+Full Riot match JSON is large and slow to walk. Most consumers only need to
+know who played which champion in which position on which team, and which
+team won. This module extracts exactly that into fixed-width records held in
+array-backed columns.
+"""
+
+import array
+import riot
+import threading
+
+
+PARTICIPANTS = 10 # fixed number of participant slots per record
+
+# position codes, 0 is reserved for an unknown position
+POSITION_CODES = {p: i for (i, p) in enumerate(riot.POSITIONS, 1)}
+POSITIONS = (None, ) + riot.POSITIONS
+
+
+def extract(match):
+    """Return a fixed-width record for the given Riot match JSON.
+
+    The record is a tuple of (match_id, winner_team_id, participants, names)
+    where participants has exactly PARTICIPANTS tuples of
+    (summoner_id, team_id, champion_id, position_code) and names maps summoner
+    ids to summoner names. Unused participant slots are all zeros. The winner
+    team id is zero when the winner couldn't be determined.
+    """
+    match_id = match.get('matchId')
+    if match_id is None:
+        return None
+
+    # map participants to summoners
+    summoner_ids = {}
+    names = {}
+    for pid in match.get('participantIdentities', []):
+        player = pid.get('player')
+        if player:
+            summoner_ids[pid['participantId']] = player['summonerId']
+            names[player['summonerId']] = player['summonerName']
+
+    # who won?
+    winner_team_id = 0
+    for team in match.get('teams', []):
+        if team.get('winner'):
+            winner_team_id = team['teamId']
+
+    participants = []
+    for p in match.get('participants', [])[:PARTICIPANTS]:
+        timeline = p.get('timeline', {})
+        participants.append((
+            summoner_ids.get(p['participantId'], 0),
+            p['teamId'],
+            p['championId'],
+            POSITION_CODES.get(riot.position(timeline.get('lane'), timeline.get('role')), 0)))
+    while len(participants) < PARTICIPANTS:
+        participants.append((0, 0, 0, 0))
+
+    return match_id, winner_team_id, tuple(participants), names
+
+
+class MatchTable:
+    """Append-only table of extracted match records stored as parallel arrays.
+    Participant columns hold PARTICIPANTS consecutive entries per row.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = {} # match_id -> row number
+        self.match_ids = array.array('q')
+        self.winners = array.array('h')
+        self.summoner_ids = array.array('q')
+        self.team_ids = array.array('h')
+        self.champion_ids = array.array('h')
+        self.positions = array.array('b')
+        self.names = {} # summoner_id -> most recently seen summoner name
+
+    def __contains__(self, match_id):
+        return match_id in self.rows
+
+    def __len__(self):
+        return len(self.match_ids)
+
+    def add(self, match):
+        """Extract the given Riot match JSON into the table and return its row number."""
+        record = extract(match)
+        if record is None:
+            return None
+        match_id, winner_team_id, participants, names = record
+        with self.lock:
+            row = self.rows.get(match_id)
+            if row is not None:
+                return row
+            row = len(self.match_ids)
+            self.match_ids.append(match_id)
+            self.winners.append(winner_team_id)
+            for summoner_id, team_id, champion_id, position_code in participants:
+                self.summoner_ids.append(summoner_id)
+                self.team_ids.append(team_id)
+                self.champion_ids.append(champion_id)
+                self.positions.append(position_code)
+            self.names.update(names)
+            self.rows[match_id] = row
+            return row
+
+    def row(self, match_id):
+        """Return the row number of the given match or None if it isn't in the table."""
+        return self.rows.get(match_id)
+
+    def participants(self, row):
+        """Return the (summoner_id, team_id, champion_id, position) tuples of the given row."""
+        start = row * PARTICIPANTS
+        end = start + PARTICIPANTS
+        return [(s, t, c, POSITIONS[p])
+            for (s, t, c, p) in zip(self.summoner_ids[start:end], self.team_ids[start:end],
+                self.champion_ids[start:end], self.positions[start:end])
+            if s]
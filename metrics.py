@@ -0,0 +1,175 @@
+"""Process metrics rendered in the Prometheus text exposition format.
+
+Counters, gauges and histograms are created at module level by the code they
+instrument and register themselves with REGISTRY. Values that already live
+elsewhere, such as lru_cache statistics or queue depths, are read at render
+time by collector callbacks instead of being mirrored into metrics.
+"""
+
+import bisect
+import collections
+import threading
+
+
+# latency buckets in seconds, from cache hits up to Riot API timeouts
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for (name, value) in pairs)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Every metric and collector rendered by the /metrics endpoint and crawler dumps."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def collector(self, function):
+        """Register a function returning (name, type, help, [(labels dict, value)]) tuples at render time."""
+        with self.lock:
+            self.collectors.append(function)
+        return function
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+            collectors = list(self.collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        # collectors may each contribute samples to the same family
+        families = collections.OrderedDict()
+        for function in collectors:
+            try:
+                for name, kind, help, samples in function():
+                    families.setdefault(name, (kind, help, []))[2].extend(samples)
+            except Exception as e:
+                lines.append('# collector %s failed: %s' % (function.__name__, escape(e)))
+        for name, (kind, help, samples) in families.items():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, format_labels(list(labels), list(labels.values())), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+
+    kind = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {} # label values -> value
+        registry.register(self)
+
+    def key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError('%s takes labels %r' % (self.name, self.labels))
+        return tuple(str(l) for l in labels)
+
+    def header(self):
+        return ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return self.header() + ['%s%s %s' % (self.name, format_labels(self.labels, key), format_value(value))
+            for (key, value) in values]
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """Cumulative bucket counts, sum and count of observations for each label set."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super(Histogram, self).__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'), )
+
+    def observe(self, value, *labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * len(self.buckets), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def render(self):
+        with self.lock:
+            values = sorted((key, (list(counts), total)) for (key, (counts, total)) in self.values.items())
+        lines = self.header()
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, format_labels(self.labels, key, [('le', format_value(bound))]), cumulative))
+            lines.append('%s_sum%s %s' % (self.name, format_labels(self.labels, key), format_value(total)))
+            lines.append('%s_count%s %d' % (self.name, format_labels(self.labels, key), cumulative))
+        return lines
+
+
+# shared by every cache layer so hit rates can be compared side by side
+CACHE_REQUESTS = Counter('lolfu_cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result'))
+
+
+def cache_lookup(cache, hit):
+    """Count a lookup in the named cache."""
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+
+# family name collectors report functools.lru_cache statistics under
+LRU_CACHE_REQUESTS = 'lolfu_lru_cache_requests_total'
+
+
+def lru_cache_info(name, function):
+    """Return collector samples of the hits and misses of a functools.lru_cache wrapped function."""
+    info = function.cache_info()
+    return [({'cache': name, 'result': 'hit'}, info.hits), ({'cache': name, 'result': 'miss'}, info.misses)]
@@ -0,0 +1,196 @@
+"""Champion pool scoring over a dense champion by champion matchup matrix.
+
+Matchup stats are loaded once into flat row-major arrays indexed by champion
+position, so scoring a pool is a handful of reductions over the pool's rows
+rather than a rebuild of per-matchup objects.
+"""
+
+import array
+import csv
+import heapq
+
+
+NO_DATA = -1.0 # winrate cell value for matchups that have never been observed
+
+
+class ChampionScore:
+    """Scores for one champion, or for a whole pool, against every opponent."""
+
+    def __init__(self, champion_id, denominator):
+        self.champion_id = champion_id
+        self.numerator = 0.0
+        self.denominator = denominator
+        self.favored = 0
+        self.unfavored = 0
+        self.counterpicks = 0
+
+    @property
+    def weighted_winrate(self):
+        return 100.0 * self.numerator / self.denominator
+
+
+class MatchupMatrix:
+    """Dense champion by opponent matrices of wins, losses and winrates along
+    with the relative frequency (weight) each champion is seen in a game.
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.champion_ids = sorted(set(c for (c1, c2, w, l) in rows for c in (c1, c2)))
+        self.index = {cid: i for (i, cid) in enumerate(self.champion_ids)}
+        n = self.size = len(self.champion_ids)
+        self.wins = array.array('l', [0]) * (n * n)
+        self.losses = array.array('l', [0]) * (n * n)
+        self.winrates = array.array('d', [NO_DATA]) * (n * n)
+        self.weights = array.array('d', [0.0]) * n
+        for champion1, champion2, w, l in rows:
+            i = self.index[champion1]
+            j = self.index[champion2]
+            self.wins[i * n + j] = w
+            self.losses[i * n + j] = l
+            if w + l:
+                self.winrates[i * n + j] = w / (w + l)
+            self.weights[i] += w + l
+            self.weights[j] += w + l
+        weight_total = sum(self.weights)
+        for i in range(n):
+            self.weights[i] *= 10.0 # account for 10 summoners/game
+            self.weights[i] /= weight_total or 1.0
+        self.denominator = sum(self.weights)
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline='') as f:
+            return cls(tuple(int(x) for x in row) for row in csv.reader(f))
+
+    def weight(self, champion_id):
+        i = self.index.get(champion_id)
+        return 0.0 if i is None else self.weights[i]
+
+    def row(self, champion_id):
+        """Return the slice bounds of the given champion's row or None if it has no matchups."""
+        i = self.index.get(champion_id)
+        if i is None:
+            return None
+        return i * self.size, (i + 1) * self.size
+
+    def score(self, champion_ids):
+        """Score the given champion pool.
+
+        Return a tuple of (champion scores, pool score, counterpicks) where
+        counterpicks holds a (champion_id, opponent_id, wins, losses) tuple for
+        the best pool champion against each opponent.
+        """
+        n = self.size
+        champion_scores = []
+        rows = []
+        for champion_id in champion_ids:
+            score = ChampionScore(champion_id, self.denominator)
+            champion_scores.append(score)
+            bounds = self.row(champion_id)
+            if bounds is None:
+                continue
+            start, end = bounds
+            rows.append((score, start))
+            for j, winrate in enumerate(self.winrates[start:end]):
+                if winrate == NO_DATA:
+                    continue
+                score.numerator += self.weights[j] * winrate
+                if winrate > 0.5:
+                    score.favored += 1
+                elif winrate < 0.5:
+                    score.unfavored += 1
+
+        # best counterpick against each opponent is a max-reduction over the pool's rows
+        pool_score = ChampionScore(None, self.denominator)
+        counterpicks = []
+        for j in range(n):
+            best = None
+            best_winrate = NO_DATA
+            for score, start in rows:
+                winrate = self.winrates[start + j]
+                if winrate > best_winrate:
+                    best, best_winrate = (score, start), winrate
+            if best is None:
+                continue
+            score, start = best
+            pool_score.numerator += self.weights[j] * best_winrate
+            if best_winrate > 0.5:
+                pool_score.favored += 1
+            elif best_winrate < 0.5:
+                pool_score.unfavored += 1
+            score.counterpicks += 1
+            counterpicks.append((score.champion_id, self.champion_ids[j], self.wins[start + j], self.losses[start + j]))
+
+        return champion_scores, pool_score, counterpicks
+
+    def pool_value(self, champion_ids):
+        """Return the weighted counterpick value of the given pool, the numerator of its weighted winrate."""
+        best = self.best_winrates([self.index[c] for c in champion_ids if c in self.index])
+        return sum(w * b for (w, b) in zip(self.weights, best))
+
+    def best_winrates(self, rows):
+        """Return the best winrate against each opponent over the given row indexes, zero when unobserved."""
+        n = self.size
+        best = [0.0] * n
+        for i in rows:
+            best = [max(b, winrate) for (b, winrate) in zip(best, self.winrates[i * n:(i + 1) * n])]
+        return best
+
+    def recommend(self, size, seed_ids=(), local_search=True):
+        """Return the champion ids of the pool of the given size with the best
+        weighted counterpick value, always including the seed champions.
+
+        Pool value is a weighted facility location objective, which is monotone
+        submodular, so greedy selection with lazily re-evaluated marginal gains
+        is within (1 - 1/e) of optimal. A swap based local search then polishes
+        the non-seed picks until no single swap improves the pool. Raises
+        ValueError if any seed champion isn't in the matrix.
+        """
+        n = self.size
+        unknown = sorted(c for c in seed_ids if c not in self.index)
+        if unknown:
+            raise ValueError('no matchup stats for champions %s' % ', '.join(str(c) for c in unknown))
+        seeds = [self.index[c] for c in seed_ids]
+        pool = list(seeds)
+        best = self.best_winrates(pool)
+
+        def gain(i, best):
+            return sum(w * (winrate - b)
+                for (w, b, winrate) in zip(self.weights, best, self.winrates[i * n:(i + 1) * n])
+                if winrate > b)
+
+        # lazy greedy, stale gains are upper bounds on current gains
+        heap = [(-gain(i, best), i) for i in range(n) if i not in pool]
+        heapq.heapify(heap)
+        while len(pool) < size and heap:
+            negative_gain, i = heapq.heappop(heap)
+            fresh = gain(i, best)
+            if heap and fresh < -heap[0][0]:
+                heapq.heappush(heap, (-fresh, i))
+                continue
+            pool.append(i)
+            best = [max(b, winrate) for (b, winrate) in zip(best, self.winrates[i * n:(i + 1) * n])]
+
+        # local search over single swaps of non-seed picks
+        improved = local_search
+        while improved:
+            improved = False
+            value = sum(w * b for (w, b) in zip(self.weights, best))
+            for r in pool[len(seeds):]:
+                without = self.best_winrates([i for i in pool if i != r])
+                swap, swap_value = None, value
+                for c in range(n):
+                    if c in pool:
+                        continue
+                    candidate_value = sum(w * max(b, winrate)
+                        for (w, b, winrate) in zip(self.weights, without, self.winrates[c * n:(c + 1) * n]))
+                    if candidate_value > swap_value + 1e-12:
+                        swap, swap_value = c, candidate_value
+                if swap is not None:
+                    pool[pool.index(r)] = swap
+                    best = self.best_winrates(pool)
+                    improved = True
+                    break
+
+        return [self.champion_ids[i] for i in pool]
@@ -11,17 +11,45 @@ https://developer.riotgames.com/api/methods
 import asyncio
 import aiohttp
 import cachetools
+import checkpoint
 import configparser
 import functools
-import json
+import matchstore
+import metrics
+import operator
 import os
 import os.path
+import re
 import requests
+import threading
 import time
 import urllib.parse
 
 CURRENT_SEASON = 'SEASON2016'
 
+# override with base_url in riot.cfg, for example to replay against fakeriot.py
+BASE_URL = 'https://na.api.pvp.net'
+
+# riot.cfg lives next to this module unless LOLFU_RIOT_CFG names another file
+RIOT_CFG = os.environ.get('LOLFU_RIOT_CFG', os.path.dirname(os.path.abspath(__file__)) + os.sep + 'riot.cfg')
+
+# in-memory cache bounds, override in the [cache] section of riot.cfg
+MATCH_CACHE_MB = 64 # estimated heap taken by parsed matches kept in memory
+MATCH_HEAP_RATIO = 4.4 # heap bytes per stored JSON byte of a parsed Riot match, as measured
+SUMMONER_CACHE_SIZE = 10000
+SUMMONER_TTL = 60 * 60 # seconds before a summoner name is looked up again, names change
+MISSING_SUMMONER_TTL = 5 * 60 # seconds to remember that a summoner name doesn't exist
+
+# Riot's development key limits as count:seconds pairs, override with rate_limits in riot.cfg
+DEFAULT_RATE_LIMITS = '10:10,500:600'
+
+# request instrumentation, labeled by endpoint path with ids and names elided
+REQUEST_SECONDS = metrics.Histogram('lolfu_riot_request_seconds', 'Riot API request latency by endpoint.', ('endpoint', ))
+RESPONSES = metrics.Counter('lolfu_riot_responses_total', 'Riot API responses by endpoint and HTTP status.', ('endpoint', 'status'))
+RETRIES = metrics.Counter('lolfu_riot_retries_total', 'Riot API requests retried by endpoint and reason.', ('endpoint', 'reason'))
+WAIT_SECONDS = metrics.Histogram('lolfu_riot_wait_seconds', 'Time requests wait before being sent by what held them up.', ('gate', ))
+MATCH_FETCH_ERRORS = metrics.Counter('lolfu_riot_match_fetch_errors_total', 'Matches that failed to fetch in the background by error.', ('error', ))
+
 # Riot's lanes
 RIOT_TOP = ('TOP', )
 RIOT_JUNGLE = ('JUNGLE', )
@@ -44,6 +72,11 @@ SUPPORT = 'SUPPORT'
 POSITIONS = (TOP, JUNGLE, MID, ADC, SUPPORT)
 
 
+def endpoint(path):
+    """Return the given API path with summoner names and trailing ids elided, for labeling metrics."""
+    return re.sub(r'/\d+$', '/{id}', re.sub(r'/by-name/[^/]+$', '/by-name/{name}', path))
+
+
 def position(lane, role):
     """Return the position for the given lane and role."""
     if lane in RIOT_TOP and role == RIOT_SOLO:
@@ -59,52 +92,260 @@ def position(lane, role):
     return None
 
 
+def parse_rate_limits(value):
+    """Return (count, seconds) tuples parsed from a Riot style "count:seconds,..." string."""
+    limits = []
+    for pair in value.split(','):
+        if pair.strip():
+            count, seconds = pair.split(':')
+            limits.append((int(count), int(seconds)))
+    return limits
+
+
+class TokenBucket:
+
+    def __init__(self, capacity, seconds):
+        self.capacity = capacity
+        self.seconds = seconds
+        self.tokens = float(capacity)
+        self.updated = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.seconds)
+        self.updated = now
+
+    def wait(self):
+        """Return the seconds until a whole token is available."""
+        return max(0.0, (1.0 - self.tokens) * self.seconds / self.capacity)
+
+
+class RateLimiter:
+    """Proactive rate limiter holding one token bucket per rate limit window.
+    Shared by every thread and coroutine using the same RiotAPI.
+    """
+
+    def __init__(self, limits):
+        self.lock = threading.Lock()
+        self.buckets = [TokenBucket(count, seconds) for (count, seconds) in limits]
+        self.blocked_until = 0.0
+
+    def reserve(self):
+        """Take a token from every window and return zero, or return the seconds to wait before trying again."""
+        with self.lock:
+            now = time.time()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            for bucket in self.buckets:
+                bucket.refill(now)
+            wait = max([b.wait() for b in self.buckets] or [0.0])
+            if wait <= 0.0:
+                for bucket in self.buckets:
+                    bucket.tokens -= 1.0
+            return wait
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    @asyncio.coroutine
+    def acquire_async(self):
+        """Wait within a coroutine until a request may be sent."""
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            yield from asyncio.sleep(wait)
+
+    def block(self, seconds):
+        """Send nothing for the given number of seconds, e.g. after Riot returns a Retry-After."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+    def update(self, headers):
+        """Adapt to Riot's view of how much of each window has been used, e.g. by other processes sharing the key."""
+        value = headers.get('X-Rate-Limit-Count')
+        if not value:
+            return
+        try:
+            counts = parse_rate_limits(value)
+        except ValueError:
+            return # ignore malformed headers
+        with self.lock:
+            now = time.time()
+            for used, seconds in counts:
+                for bucket in self.buckets:
+                    if bucket.seconds == seconds:
+                        bucket.refill(now)
+                        bucket.tokens = min(bucket.tokens, float(bucket.capacity - used))
+
+
+class Flight:
+    """A single in-flight API call that concurrent threads wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def done(self, result, error=None):
+        self.result = result
+        self.error = error
+        self.event.set()
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def merge_matchlist(known, newer):
+    """Return the known matchlist with any entries of the newer one it lacks, newest first."""
+    known_ids = {m['matchId'] for m in known}
+    added = [m for m in newer if m['matchId'] not in known_ids]
+    if not added:
+        return known
+    return sorted(added + known, key=lambda m: m['timestamp'], reverse=True)
+
+
+class MatchlistStore:
+    """Current season matchlists persisted one file per summoner, so refreshing
+    a matchlist only has to ask the API for games newer than those already known.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, summoner_id):
+        return os.path.join(self.directory, '%d.dat' % summoner_id)
+
+    def get(self, summoner_id):
+        """Return the stored matchlist, newest first, or None if none is stored for this season."""
+        state = checkpoint.load(self.path(summoner_id))
+        if state and state['season'] == CURRENT_SEASON:
+            return state['matches']
+        return None
+
+    def put(self, summoner_id, matches):
+        checkpoint.save(self.path(summoner_id), {'season': CURRENT_SEASON, 'matches': matches})
+
+
 class RiotAPI:
 
-    base_url = 'https://na.api.pvp.net'
+    timeout = 10 # seconds to wait on any single async request
 
-    def __init__(self, logger, cache_dir):
+    def __init__(self, logger, cache_dir, persist_matchlists=False):
         cfg = configparser.SafeConfigParser()
-        cfg.read(os.path.dirname(os.path.abspath(__file__)) + os.sep + 'riot.cfg')
+        cfg.read(RIOT_CFG)
         self.api_key = cfg.get('riot', 'api_key')
+        self.base_url = cfg.get('riot', 'base_url', fallback=BASE_URL).rstrip('/')
+        self.rate_limiter = RateLimiter(parse_rate_limits(cfg.get('riot', 'rate_limits', fallback=DEFAULT_RATE_LIMITS)))
         self.logger = logger
         self.cache_dir = cache_dir
-
-    def _cache_file_check(self, cache_file):
-        return os.path.exists(cache_file)
-
-    def _cache_file_read(self, cache_file):
-        if cache_file:
-            try:
-                with open(cache_file, 'r') as f:
-                    return json.load(f)
-            except OSError:
-                pass # cache file does not exist
+        self.match_store = matchstore.MatchStore(os.path.join(cache_dir, 'match_store'))
+        # worth it for the site's revisits of active summoners, not for millions of crawled ones
+        self.matchlist_store = MatchlistStore(os.path.join(cache_dir, 'matchlists')) if persist_matchlists else None
+        self.flights_lock = threading.Lock()
+        self.flights = {} # in-flight calls shared between threads
+        self.futures = {} # in-flight calls shared between coroutines of the same event loop
+        self.cache_lock = threading.Lock()
+        self.matchlists = cachetools.TTLCache(maxsize=1024, ttl=60)
+        # parsed matches bounded by their estimated heap size, values are (match, size)
+        self.matches = cachetools.LRUCache(maxsize=cfg.getint('cache', 'match_cache_mb', fallback=MATCH_CACHE_MB) << 20,
+            getsizeof=operator.itemgetter(1))
+        self.summoners = cachetools.TTLCache(maxsize=cfg.getint('cache', 'summoner_cache_size', fallback=SUMMONER_CACHE_SIZE),
+            ttl=cfg.getint('cache', 'summoner_ttl', fallback=SUMMONER_TTL))
+        self.missing_summoners = cachetools.TTLCache(maxsize=cfg.getint('cache', 'summoner_cache_size', fallback=SUMMONER_CACHE_SIZE),
+            ttl=cfg.getint('cache', 'missing_summoner_ttl', fallback=MISSING_SUMMONER_TTL))
+        metrics.REGISTRY.collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        with self.cache_lock:
+            caches = [('matchlists', self.matchlists), ('matches', self.matches),
+                ('summoners', self.summoners), ('missing_summoners', self.missing_summoners)]
+            sizes = [({'cache': name}, cache.currsize) for (name, cache) in caches]
+            capacities = [({'cache': name}, cache.maxsize) for (name, cache) in caches]
+        yield ('lolfu_cache_size', 'gauge', 'Current size of each cache, in estimated heap bytes for matches and entries otherwise.', sizes)
+        yield ('lolfu_cache_capacity', 'gauge', 'Largest size of each cache before it evicts.', capacities)
+
+    def _cache_read(self, cache_id):
+        if cache_id is not None:
+            with self.cache_lock:
+                cached = self.matches.get(cache_id)
+            metrics.cache_lookup('matches', cached is not None)
+            if cached is not None:
+                return cached[0]
+            result = self.match_store.get(cache_id)
+            metrics.cache_lookup('match_store', result is not None)
+            if result is not None:
+                self._cache_match(cache_id, result)
+            return result
         return None
 
-    def _cache_file_write(self, cache_file, result):
-        if cache_file and result:
-            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
-            try:
-                with open(cache_file, 'x') as f:
-                    json.dump(result, f)
-            except FileExistsError:
-                pass # okay if some other process has/is already cached this
-
-    def call(self, path, cache_file=False, **params):
-        """Execute a remote API call and return the JSON results."""
+    def _cache_match(self, match_id, match):
+        """Keep the given stored match in memory unless it alone would exceed the cache."""
+        size = int((self.match_store.size(match_id) or 0) * MATCH_HEAP_RATIO)
+        if size and size <= self.matches.maxsize:
+            with self.cache_lock:
+                self.matches[match_id] = (match, size)
+
+    def _cache_write(self, cache_id, result):
+        if cache_id is not None and result:
+            self.match_store.put(cache_id, result)
+            self._cache_match(cache_id, result)
+
+    def _flight_key(self, path, params):
+        return (path, tuple(sorted(params.items())))
+
+    def call(self, path, cache_id=None, **params):
+        """Execute a remote API call and return the JSON results. Concurrent
+        identical calls from multiple threads share a single remote request.
+        """
         params['api_key'] = self.api_key
 
-        result = self._cache_file_read(cache_file)
+        result = self._cache_read(cache_id)
         if result:
             return result
 
+        key = self._flight_key(path, params)
+        with self.flights_lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            return flight.wait()
+
+        try:
+            result = self._fetch(path, cache_id, params)
+        except Exception as e:
+            flight.done(None, e)
+            raise
+        else:
+            flight.done(result)
+            return result
+        finally:
+            with self.flights_lock:
+                del self.flights[key]
+
+    def _fetch(self, path, cache_id, params):
         retry_seconds = 1
         while True:
 
+            start = time.time()
+            self.rate_limiter.acquire()
+            WAIT_SECONDS.observe(time.time() - start, 'rate_limit')
             start = time.time()
             response = requests.get(self.base_url + path, params=params)
             end = time.time()
+            self.rate_limiter.update(response.headers)
+            REQUEST_SECONDS.observe(end - start, endpoint(path))
+            RESPONSES.inc(endpoint(path), response.status_code)
             if self.logger:
                 self.logger.log('[%.0fms] %d %s' % (1000.0 * (end - start), response.status_code, path))
 
@@ -117,11 +358,13 @@ class RiotAPI:
                 # retry after we're within our rate limit
                 # 429 is the expected "retry later" code
                 # 403 is expected after we've violated too many times and have been blacklisted
-                time.sleep(float(response.headers.get('Retry-After', retry_seconds)))
+                self.rate_limiter.block(float(response.headers.get('Retry-After', retry_seconds)))
+                RETRIES.inc(endpoint(path), 'rate_limit')
                 retry_seconds *= 2
                 continue
             elif response.status_code in (500, 502, 503, 504):
                 # retry when the Riot API is having (hopefully temporary) difficulties
+                RETRIES.inc(endpoint(path), 'server_error')
                 time.sleep(retry_seconds)
                 retry_seconds *= 2
                 continue
@@ -129,50 +372,98 @@ class RiotAPI:
             break
 
         result = response.json()
-        self._cache_file_write(cache_file, result)
+        self._cache_write(cache_id, result)
         return result
 
     @asyncio.coroutine
-    def call_async(self, session, path, cache_file=False, **params):
+    def call_async(self, session, path, cache_id=None, **params):
+        """Execute a remote API call within a coroutine and return the JSON results.
+        Concurrent identical calls on the same event loop share a single remote request.
+        """
         params['api_key'] = self.api_key
 
-        result = self._cache_file_read(cache_file)
+        result = self._cache_read(cache_id)
         if result:
             return result
 
+        key = (asyncio.get_event_loop(), ) + self._flight_key(path, params)
+        future = self.futures.get(key)
+        if future is not None:
+            # shield so a cancelled follower doesn't cancel the call for everyone else
+            return (yield from asyncio.shield(future))
+
+        future = self.futures[key] = asyncio.Future()
+        try:
+            result = yield from self._fetch_async(session, path, cache_id, params)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # mark retrieved, the error is raised to the leader below
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.futures[key]
+
+    @asyncio.coroutine
+    def _fetch_async(self, session, path, cache_id, params):
         retry_seconds = 1
         while True:
             retry_after = None
+            start = time.time()
             with (yield from session.sem):
+                WAIT_SECONDS.observe(time.time() - start, 'semaphore')
+                start = time.time()
+                yield from self.rate_limiter.acquire_async()
+                WAIT_SECONDS.observe(time.time() - start, 'rate_limit')
                 start = time.time()
-                response = yield from session.get(self.base_url + path, params=params)
                 try:
-                    end = time.time()
+                    response = yield from asyncio.wait_for(session.get(self.base_url + path, params=params), self.timeout)
+                except asyncio.TimeoutError:
+                    response = None
+                    retry_after = retry_seconds
+                    retry_seconds *= 2
+                    RESPONSES.inc(endpoint(path), 'timeout')
+                    RETRIES.inc(endpoint(path), 'timeout')
                     if self.logger:
-                        self.logger.log('[%.0fms] %d %s' % (1000.0 * (end - start), response.status, path))
-                    # https://developer.riotgames.com/docs/response-codes
-                    # https://en.wikipedia.org/wiki/List_of_HTTP_status_codes
-                    if response.status == 404:
-                        # API returns 404 when the requested entity doesn't exist
-                        result = None
-                        break
-                    elif response.status == 429:
-                        # retry after we're within our rate limit
-                        retry_after = float(response.headers.get('Retry-After', retry_seconds))
-                    elif response.status in (500, 502, 503, 504):
-                        # retry when the Riot API is having (hopefully temporary) difficulties
-                        retry_after = retry_seconds
-                        retry_seconds *= 2
-                    else:
-                        result = yield from response.json()
-                        break
-                finally:
-                    response.close()
+                        self.logger.log('[%.0fms] timeout %s' % (1000.0 * (time.time() - start), path))
+                if response is not None:
+                    try:
+                        end = time.time()
+                        self.rate_limiter.update(response.headers)
+                        REQUEST_SECONDS.observe(end - start, endpoint(path))
+                        RESPONSES.inc(endpoint(path), response.status)
+                        if self.logger:
+                            self.logger.log('[%.0fms] %d %s' % (1000.0 * (end - start), response.status, path))
+                        # https://developer.riotgames.com/docs/response-codes
+                        # https://en.wikipedia.org/wiki/List_of_HTTP_status_codes
+                        if response.status == 404:
+                            # API returns 404 when the requested entity doesn't exist
+                            result = None
+                            break
+                        elif response.status == 429:
+                            # retry after we're within our rate limit
+                            retry_after = float(response.headers.get('Retry-After', retry_seconds))
+                            self.rate_limiter.block(retry_after)
+                            RETRIES.inc(endpoint(path), 'rate_limit')
+                        elif response.status in (500, 502, 503, 504):
+                            # retry when the Riot API is having (hopefully temporary) difficulties
+                            RETRIES.inc(endpoint(path), 'server_error')
+                            retry_after = retry_seconds
+                            retry_seconds *= 2
+                        else:
+                            result = yield from response.json()
+                            break
+                    finally:
+                        response.close()
 
             if retry_after:
                 yield from asyncio.sleep(retry_after)
 
-        self._cache_file_write(cache_file, result)
+        self._cache_write(cache_id, result)
         return result
 
     def champion_ids(self):
@@ -196,22 +487,21 @@ class RiotAPI:
         """Return all champions."""
         return self.call('/api/lol/static-data/na/v1.2/champion', champData='image', dataById='true')
 
-    def match_cache_file(self, match_id):
-        return os.path.join(self.cache_dir, 'match',
-            str(match_id)[-1], str(match_id)[-2], str(match_id)[-3], '%d.dat' % match_id)
-
     def match_path(self, match_id):
         return '/api/lol/na/v2.2/match/%d' % match_id
 
-    @functools.lru_cache()
+    def stored_match(self, match_id):
+        """Return the requested match if it has been fetched before, never calling the API."""
+        return self._cache_read(match_id)
+
     def match(self, match_id):
         """Return the requested match."""
-        return self.call(self.match_path(match_id), cache_file=self.match_cache_file(match_id))
+        return self.call(self.match_path(match_id), cache_id=match_id)
 
     @asyncio.coroutine
     def match_async(self, session, match_id):
         """Return the requested match within a coroutine."""
-        return (yield from self.call_async(session, self.match_path(match_id), cache_file=self.match_cache_file(match_id)))
+        return (yield from self.call_async(session, self.match_path(match_id), cache_id=match_id))
 
     @asyncio.coroutine
     def match_nocache_async(self, session, match_id):
@@ -226,31 +516,95 @@ class RiotAPI:
     def matchlist_path(self, summoner_id):
         return '/api/lol/na/v2.2/matchlist/by-summoner/%s' % summoner_id
 
-    @cachetools.ttl_cache(ttl=60)
-    def matchlist(self, summoner_id):
-        """Return the match list for the given summoner."""
-        matchlist = self.call(self.matchlist_path(summoner_id), seasons=CURRENT_SEASON)
+    def _matchlist(self, matchlist):
         if matchlist:
             return matchlist.get('matches', [])
         return []
 
-    def matchlist_check(self, summoner_id):
-        """Return the count of the number of matches by the summoner already known and total as a tuple."""
-        matchlist = self.matchlist(summoner_id)
-        return (sum(self._cache_file_check(self.match_cache_file(m['matchId'])) for m in matchlist), len(matchlist))
+    def _matchlist_cached(self, summoner_id):
+        with self.cache_lock:
+            matchlist = self.matchlists.get(summoner_id)
+        metrics.cache_lookup('matchlists', matchlist is not None)
+        return matchlist
+
+    def _matchlist_stored(self, summoner_id):
+        """Return the persisted matchlist to refresh, or None to fetch the whole season."""
+        if self.matchlist_store is None:
+            return None
+        known = self.matchlist_store.get(summoner_id)
+        metrics.cache_lookup('matchlist_store', known is not None)
+        return known
+
+    def _matchlist_params(self, known):
+        params = {'seasons': CURRENT_SEASON}
+        if known:
+            # beginTime is inclusive, games sharing the newest timestamp are deduplicated by the merge
+            params['beginTime'] = known[0]['timestamp']
+        return params
+
+    def _matchlist_save(self, summoner_id, known, matchlist):
+        if self.matchlist_store is not None and matchlist is not known:
+            self.matchlist_store.put(summoner_id, matchlist)
+        with self.cache_lock:
+            self.matchlists[summoner_id] = matchlist
+
+    def matchlist(self, summoner_id):
+        """Return the match list for the given summoner."""
+        matchlist = self._matchlist_cached(summoner_id)
+        if matchlist is None:
+            known = self._matchlist_stored(summoner_id)
+            response = self.call(self.matchlist_path(summoner_id), **self._matchlist_params(known))
+            matchlist = merge_matchlist(known or [], self._matchlist(response))
+            self._matchlist_save(summoner_id, known, matchlist)
+        return matchlist
 
     @asyncio.coroutine
     def matchlist_async(self, session, summoner_id):
         """Return the match list for the given summoner within a coroutine."""
-        matchlist = yield from self.call_async(session, self.matchlist_path(summoner_id), seasons=CURRENT_SEASON)
-        if matchlist:
-            return matchlist.get('matches', [])
-        return []
+        matchlist = self._matchlist_cached(summoner_id)
+        if matchlist is None:
+            # persisted matchlists are read and fsynced off the event loop
+            loop = asyncio.get_event_loop()
+            known = yield from loop.run_in_executor(None, self._matchlist_stored, summoner_id)
+            response = yield from self.call_async(session, self.matchlist_path(summoner_id), **self._matchlist_params(known))
+            matchlist = merge_matchlist(known or [], self._matchlist(response))
+            yield from loop.run_in_executor(None, self._matchlist_save, summoner_id, known, matchlist)
+        return matchlist
 
-    @functools.lru_cache()
-    def summoner_by_name(self, name):
-        """Return the summoner having the given name."""
-        summoner = self.call('/api/lol/na/v1.4/summoner/by-name/%s' % urllib.parse.quote(name))
+    @asyncio.coroutine
+    def matches_async(self, session, match_ids, progress=None):
+        """Fetch the given matches concurrently within a coroutine, skipping those already stored.
+        When given, progress is called with the (known, total) count of matches up front and
+        again as each missing match lands.
+        """
+        match_ids = [match_id for match_id in match_ids if match_id is not None]
+        missing = [match_id for match_id in match_ids if match_id not in self.match_store]
+        known = len(match_ids) - len(missing)
+        if progress:
+            progress(known, len(match_ids))
+
+        @asyncio.coroutine
+        def fetch(match_id):
+            nonlocal known
+            try:
+                yield from self.match_async(session, match_id)
+            finally:
+                known += 1
+                if progress:
+                    progress(known, len(match_ids))
+
+        if missing:
+            results = yield from asyncio.gather(*[fetch(match_id) for match_id in missing], return_exceptions=True)
+            for match_id, result in zip(missing, results):
+                if isinstance(result, Exception):
+                    MATCH_FETCH_ERRORS.inc(type(result).__name__)
+                    if self.logger:
+                        self.logger.log('match %d failed to fetch: %r' % (match_id, result))
+
+    def summoner_path(self, name):
+        return '/api/lol/na/v1.4/summoner/by-name/%s' % urllib.parse.quote(name)
+
+    def _summoner(self, summoner):
         if summoner:
             for standardized_name, dto in summoner.items():
                 summoner_id = dto['id']
@@ -258,6 +612,43 @@ class RiotAPI:
                 return Summoner(summoner_id, name, standardized_name)
         return None
 
+    def _summoner_cached(self, name):
+        """Return the cached summoner for the given name and whether it is known not to exist."""
+        with self.cache_lock:
+            summoner = self.summoners.get(name)
+            missing = summoner is None and name in self.missing_summoners
+        metrics.cache_lookup('summoners', summoner is not None or missing)
+        return summoner, missing
+
+    def _summoner_cache(self, name, summoner):
+        with self.cache_lock:
+            if summoner:
+                self.summoners[name] = summoner
+            else:
+                self.missing_summoners[name] = True
+        return summoner
+
+    def summoner_by_name(self, name):
+        """Return the summoner having the given name."""
+        summoner, missing = self._summoner_cached(name)
+        if summoner is None and not missing:
+            summoner = self._summoner_cache(name, self._summoner(self.call(self.summoner_path(name))))
+        return summoner
+
+    @asyncio.coroutine
+    def summoner_by_name_async(self, session, name):
+        """Return the summoner having the given name within a coroutine."""
+        summoner, missing = self._summoner_cached(name)
+        if summoner is None and not missing:
+            summoner = self._summoner_cache(name, self._summoner((yield from self.call_async(session, self.summoner_path(name)))))
+        return summoner
+
+
+@metrics.REGISTRY.collector
+def lru_caches():
+    yield (metrics.LRU_CACHE_REQUESTS, 'counter', 'functools.lru_cache lookups by cache and result.',
+        metrics.lru_cache_info('champions', RiotAPI.champions))
+
 
 class Summoner:
 
@@ -267,6 +658,41 @@ class Summoner:
         self.standardized_name = standardized_name
 
 
+class BackgroundLoop(threading.Thread):
+    """Event loop running in a daemon thread with one long-lived, pooled
+    ClientSession. Blocking code such as CherryPy page handlers submits API
+    coroutines to it instead of making blocking calls themselves.
+    """
+
+    def __init__(self, timeout=15):
+        super(BackgroundLoop, self).__init__(name='BackgroundLoop', daemon=True)
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        self.ready = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.session = ClientSession()
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.session.close()
+
+    def submit(self, coroutine_function, *args):
+        """Schedule coroutine_function(session, *args) on the loop and return a concurrent.futures.Future."""
+        self.ready.wait()
+        return asyncio.run_coroutine_threadsafe(coroutine_function(self.session, *args), self.loop)
+
+    def call(self, coroutine_function, *args):
+        """Run coroutine_function(session, *args) on the loop and return its result,
+        raising concurrent.futures.TimeoutError if it takes too long. The
+        coroutine keeps running in the background after a timeout.
+        """
+        return self.submit(coroutine_function, *args).result(self.timeout)
+
+
 class ClientSession(aiohttp.ClientSession):
 
     MAX_CONCURRENCY = 100
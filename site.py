@@ -7,17 +7,26 @@ http://leagueoflegends.com
 
 import asyncio
 import argparse
+import cachetools
+import checkpoint
 import cherrypy
-import csv
+import concurrent.futures
+import functools
+import hashlib
+import heapq
 import itertools
+import matchtable
+import metrics
 import operator
 import os
 import os.path
-import queue
+import pool
 import random
 import riot
 import threading
+import time
 import urllib.parse
+import winstats
 from mako.lookup import TemplateLookup
 
 
@@ -27,10 +36,45 @@ STATIC_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep + 'static'
 FONT_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep + 'static' + os.sep + 'fonts'
 FRONTPAGE_DIR = os.path.join(STATIC_DIR, 'img', 'splash', 'frontpage')
 TMP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep + 'tmp'
+SUMMONER_STATS_DIR = 'summoner_stats' # within the data directory
+SUMMONER_QUEUE_FILE = 'summoner_queue.dat' # within the data directory
 
 
 lookup = TemplateLookup(directories=HTML_DIR, module_directory=TMP_DIR)
 
+ROUTE_SECONDS = metrics.Histogram('lolfu_route_seconds',
+    'Time spent serving each route, split into Mako rendering and everything else.', ('route', 'phase'))
+SUMMONER_FETCH_TIMEOUTS = metrics.Counter('lolfu_summoner_fetch_timeouts_total',
+    'Summoner pages rendered before all their missing matches were fetched.')
+
+
+class RouteTimer(cherrypy.Tool):
+    """Times every request, attributing time spent in Lolfu.html to the render phase."""
+
+    def __init__(self):
+        super(RouteTimer, self).__init__('on_start_resource', self.start)
+
+    def _setup(self):
+        super(RouteTimer, self)._setup()
+        cherrypy.request.hooks.attach('on_end_request', self.end)
+
+    def start(self):
+        cherrypy.request.route_start = time.time()
+        cherrypy.request.render_seconds = 0.0
+
+    def end(self):
+        request = cherrypy.request
+        start = getattr(request, 'route_start', None)
+        if start is None:
+            return
+        handler = getattr(request.handler, 'callable', None)
+        route = getattr(handler, '__name__', 'unknown')
+        ROUTE_SECONDS.observe(request.render_seconds, route, 'render')
+        ROUTE_SECONDS.observe(time.time() - start - request.render_seconds, route, 'compute')
+
+
+cherrypy.tools.route_timer = RouteTimer()
+
 
 @cherrypy.popargs('who')
 class Lolfu:
@@ -39,63 +83,73 @@ class Lolfu:
     winrate optimal champions to play in each position.
     """
 
-    def __init__(self):
-        self.api = riot.RiotAPI(cherrypy, DATA_DIR)
+    _cp_config = {'tools.route_timer.on': True}
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.api = riot.RiotAPI(cherrypy, data_dir, persist_matchlists=True)
+        self.client = riot.BackgroundLoop()
+        self.client.start()
         self.splashes = os.listdir(FRONTPAGE_DIR)
 
         # summoner page init
-        self.summoner_queue = queue.Queue()
-        DataCollectorThread(self.api, self.summoner_queue).start()
-
-        # stats page init
-        # load kill stats from csv file
-        self.kill_stats = {}
-        with open(os.path.join(DATA_DIR, 'kill_stats.csv'), newline='') as f:
-            for w, l, uk, tk in csv.reader(f):
-                self.kill_stats[tuple(int(x) for x in (uk, tk))] = tuple(int(x) for x in (w, l))
-        # load tower stats from csv file
-        self.tower_stats = {}
-        with open(os.path.join(DATA_DIR, 'tower_stats.csv'), newline='') as f:
-            for w, l, ui, ut, ti, tt in csv.reader(f):
-                self.tower_stats[tuple(int(x) for x in (ui, ut, ti, tt))] = tuple(int(x) for x in (w, l))
-        # load joint stats from csv file
-        self.joint_stats = {}
-        with open(os.path.join(DATA_DIR, 'joint_stats.csv'), newline='') as f:
-            for w, l, ui, ut, uk, ti, tt, tk in csv.reader(f):
-                self.joint_stats[tuple(int(x) for x in (ui, ut, uk, ti, tt, tk))] = tuple(int(x) for x in (w, l))
-
-        # pool page init
-        self.weights = {}
-        self.matchups = {}
-        with open(os.path.join(DATA_DIR, 'matchup_stats.csv'), newline='') as f:
-            for row in csv.reader(f):
-                champion1, champion2, w, l = (int(x) for x in row)
-                self.matchups.setdefault(champion1, {})
-                self.matchups[champion1][champion2] = (w, l)
-                self.weights.setdefault(champion1, 0)
-                self.weights[champion1] += w + l
-                self.weights.setdefault(champion2, 0)
-                self.weights[champion2] += w + l
-        weight_total = sum(self.weights.values())
-        for key in self.weights:
-            self.weights[key] *= 10.0 # account for 10 summoners/game
-            self.weights[key] /= weight_total
+        self.summoner_stats = SummonerStatsStore(self.api, os.path.join(data_dir, SUMMONER_STATS_DIR))
+        self.summoner_queue = SummonerQueue(os.path.join(data_dir, SUMMONER_QUEUE_FILE))
+        self.summoner_progress_tracker = SummonerProgress()
+        DataCollector(self.api, self.client, self.summoner_stats, self.summoner_queue, self.summoner_progress_tracker).start()
+
+        # stats and pool page init, reloaded in the background whenever the crawlers publish new data
+        self.tables = StatsTables(data_dir)
+        StatsReloaderThread(self, data_dir).start()
+
+        metrics.REGISTRY.collector(self.collect_metrics)
 
     def html(self, template, **kw):
-        return lookup.get_template(template).render_unicode(**kw).encode('utf-8', 'replace')
+        start = time.time()
+        try:
+            return lookup.get_template(template).render_unicode(**kw).encode('utf-8', 'replace')
+        finally:
+            if hasattr(cherrypy.request, 'render_seconds'):
+                cherrypy.request.render_seconds += time.time() - start
+
+    def collect_metrics(self):
+        tables = self.tables
+        yield (metrics.LRU_CACHE_REQUESTS, 'counter', 'functools.lru_cache lookups by cache and result.',
+            metrics.lru_cache_info('kill_stats_estimate', tables.kill_stats.estimate) +
+            metrics.lru_cache_info('tower_stats_estimate', tables.tower_stats.estimate) +
+            metrics.lru_cache_info('joint_stats_estimate', tables.joint_stats.estimate))
+        status = self.summoner_queue.status()
+        yield ('lolfu_summoner_queue_depth', 'gauge', 'Summoners waiting for their data to be collected.',
+            [({'priority': 'page'}, status['page_depth']), ({'priority': 'any'}, status['depth'])])
+        yield ('lolfu_summoner_queue_lag_seconds', 'gauge', 'Longest a queued summoner has been waiting.',
+            [({}, status['oldest_lag'])])
+
+    @cherrypy.expose
+    def metrics(self):
+        """Return process metrics in the Prometheus text format."""
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return metrics.REGISTRY.render().encode('utf-8')
 
     def random_splash(self):
         return random.choice(self.splashes)
 
+    def riot_call(self, coroutine_function, *args):
+        """Run a RiotAPI coroutine on the background loop without tying up this thread indefinitely."""
+        try:
+            return self.client.call(coroutine_function, *args)
+        except concurrent.futures.TimeoutError:
+            raise cherrypy.HTTPError(504, 'Riot API took too long to respond')
+
     @cherrypy.expose
     def index(self, who=None):
         """Return either the app homepage or the summoner's homepage."""
 
         if who:
-            summoner = self.api.summoner_by_name(who)
+            summoner = self.riot_call(self.api.summoner_by_name_async, who)
             if summoner:
-                # queue this summoner's data to be collected in a background thread
-                self.summoner_queue.put(summoner.summoner_id)
+                # queue this summoner's data to be collected in the background, ahead of refreshes
+                self.summoner_queue.put(summoner.summoner_id, SummonerQueue.PAGE)
+                # progress left over from an earlier collection must not count for this one
+                self.summoner_progress_tracker.start(summoner.summoner_id)
                 return self.html('summoner.html', summoner=summoner)
             else:
                 return self.html('index.html', random_splash=self.random_splash(), error=who)
@@ -110,28 +164,20 @@ class Lolfu:
     @cherrypy.expose
     def pool_content(self, **champions):
 
-        class Pool:
-            def __init__(self, denominator):
-                self.numerator = 0
-                self.denominator = denominator
-                self.favored = 0
-                self.unfavored = 0
-            @property
-            def weighted_winrate(self):
-                return 100.0 * self.numerator / self.denominator
-
-        class Champion(Pool):
-            def __init__(self, api, champion_id, denominator):
-                super(Champion, self).__init__(denominator)
-                self.champion_id = champion_id
-                self.champion_image = api.champion_image(champion_id)
-                self.champion_name = api.champion_name(champion_id)
-                self.champion_key = api.champion_key(champion_id)
-                self.counterpicks = 0
+        class Champion:
+            def __init__(self, api, score):
+                self.champion_id = score.champion_id
+                self.champion_image = api.champion_image(score.champion_id)
+                self.champion_name = api.champion_name(score.champion_id)
+                self.champion_key = api.champion_key(score.champion_id)
+                self.weighted_winrate = score.weighted_winrate
+                self.favored = score.favored
+                self.unfavored = score.unfavored
+                self.counterpicks = score.counterpicks
 
         class Matchup:
-            def __init__(self, api, weights, champion_id, opponent_id, w, l):
-                self.weights = weights
+            def __init__(self, api, weight, champion_id, opponent_id, w, l):
+                self.weight = weight
                 self.champion_id = champion_id
                 self.champion_image = api.champion_image(champion_id)
                 self.champion_name = api.champion_name(champion_id)
@@ -143,121 +189,130 @@ class Lolfu:
                 self.wins = w
                 self.losses = l
                 self.winrate = 100.0 * self.wins / (self.wins + self.losses)
-            @property
-            def weight(self):
-                return self.weights.get(self.opponent_id, 0.0)
-
-        def pool_compute(champion_ids):
-            denominator = sum(self.weights.values())
-
-            pool_champions = [Champion(self.api, int(c), denominator) for c in champion_ids]
-
-            matchups = []
-            for champion in pool_champions:
-                for opponent_id in self.matchups.get(champion.champion_id, {}):
-                    wins, losses = self.matchups[champion.champion_id][opponent_id]
-                    matchup = Matchup(self.api, self.weights, champion.champion_id, opponent_id, wins, losses)
-                    champion.numerator += self.weights.get(opponent_id, 0.0) * wins / (wins + losses)
-                    if matchup.winrate > 50.0:
-                        champion.favored += 1
-                    elif matchup.winrate < 50.0:
-                        champion.unfavored += 1
-                    matchups.append(matchup)
-
-            pool_stats = Pool(denominator)
-            pool_matchups = []
-            for matchup in sorted(matchups, key=operator.attrgetter('winrate'), reverse=True):
-                if matchup.opponent_id not in [m.opponent_id for m in pool_matchups]:
-                    pool_stats.numerator += matchup.weight * matchup.wins / (matchup.wins + matchup.losses)
-                    if matchup.winrate > 50.0:
-                        pool_stats.favored += 1
-                    elif matchup.winrate < 50.0:
-                        pool_stats.unfavored += 1
-                    pool_matchups.append(matchup)
-                    for champion in pool_champions:
-                        if champion.champion_id == matchup.champion_id:
-                            champion.counterpicks += 1
-
-            return sorted(pool_champions, key=operator.attrgetter('weighted_winrate'), reverse=True), \
-                pool_stats, \
-                sorted(pool_matchups, key=operator.attrgetter('weight'), reverse=True)
 
         # compute value of current champion pool
-        champion_ids = set(champions.values())
-        pool_champions, pool_stats, pool_matchups = pool_compute(champion_ids)
+        champion_ids = set(int(c) for c in champions.values())
+        matchup_matrix = self.tables.matchup_matrix
+        scores, pool_stats, counterpicks = matchup_matrix.score(champion_ids)
+
+        # only the visible results are turned into template objects
+        pool_champions = [Champion(self.api, score) for score in scores]
+        pool_matchups = [Matchup(self.api, matchup_matrix.weight(opponent_id), champion_id, opponent_id, w, l)
+            for (champion_id, opponent_id, w, l) in counterpicks]
+
+        return self.html('pool_content.html', pool_stats=pool_stats,
+            pool_champions=sorted(pool_champions, key=operator.attrgetter('weighted_winrate'), reverse=True),
+            matchups=sorted(pool_matchups, key=operator.attrgetter('weight'), reverse=True))
 
-        return self.html('pool_content.html', pool_stats=pool_stats, pool_champions=pool_champions, matchups=pool_matchups);
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def pool_recommend(self, size=3, **champions):
+        """Return the best champion pool of the given size that includes the given champions."""
+        seed_ids = set(int(c) for c in champions.values())
+        size = max(1, min(int(size), 10), len(seed_ids))
+        try:
+            return {'champion_ids': self.tables.matchup_matrix.recommend(size, seed_ids)}
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
 
     @cherrypy.expose
     def stats(self):
         return self.html('stats.html')
 
+    def stats_for(self, table, key):
+        wins, losses = table.get(key)
+        return {'wins' : wins, 'losses' : losses, 'winrate' : table.estimate(tuple(key))}
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def stats_joint(self, youri, yourt, yourk, theiri, theirt, theirk):
-        stats = self.joint_stats.get(tuple(int(x) for x in (youri, yourt, yourk, theiri, theirt, theirk)), (0, 0))
-        return {'wins' : stats[0], 'losses' : stats[1]}
+        return self.stats_for(self.tables.joint_stats, tuple(int(x) for x in (youri, yourt, yourk, theiri, theirt, theirk)))
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def stats_tower(self, youri, yourt, theiri, theirt):
-        stats = self.tower_stats.get(tuple(int(x) for x in (youri, yourt, theiri, theirt)), (0, 0))
-        return {'wins' : stats[0], 'losses' : stats[1]}
+        return self.stats_for(self.tables.tower_stats, tuple(int(x) for x in (youri, yourt, theiri, theirt)))
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def stats_kill(self, yourk, theirk):
-        stats = self.kill_stats.get(tuple(int(x) for x in (yourk, theirk)), (0, 0))
-        return {'wins' : stats[0], 'losses' : stats[1]}
+        return self.stats_for(self.tables.kill_stats, tuple(int(x) for x in (yourk, theirk)))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def stats_neighborhood(self, youri, yourt, yourk, theiri, theirt, theirk):
+        """Return joint, tower and kill stats for a game state along with joint stats
+        for every state one more inhibitor, tower or kill away, all in one response.
+        """
+        state = [int(x) for x in (youri, yourt, yourk, theiri, theirt, theirk)]
+        tables = self.tables # one consistent snapshot for the whole response
+
+        # responses only change when the stats are reloaded
+        cherrypy.response.headers['ETag'] = '"%s"' % tables.version
+        cherrypy.response.headers['Cache-Control'] = 'public, max-age=300'
+        cherrypy.lib.cptools.validate_etags()
+
+        ui, ut, uk, ti, tt, tk = state
+        neighborhood = {}
+        for i, name in enumerate(('youri', 'yourt', 'yourk', 'theiri', 'theirt', 'theirk')):
+            key = list(state)
+            key[i] += 1
+            neighborhood[name] = self.stats_for(tables.joint_stats, key)
+        return {
+            'joint' : self.stats_for(tables.joint_stats, state),
+            'tower' : self.stats_for(tables.tower_stats, (ui, ut, ti, tt)),
+            'kill' : self.stats_for(tables.kill_stats, (uk, tk)),
+            'next' : neighborhood,
+        }
 
     @cherrypy.expose
     def summoner(self, who):
         """Return a webpage with details about the given summoner."""
-        summoner = self.api.summoner_by_name(who)
+        summoner = self.riot_call(self.api.summoner_by_name_async, who)
         if not summoner:
             raise cherrypy.HTTPRedirect('/?who=' + urllib.parse.quote(who), 307)
         raise cherrypy.HTTPRedirect('/' + summoner.standardized_name, 301)
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
-    def summoner_check(self, summoner_id):
-        known, total = self.api.matchlist_check(summoner_id)
-        return {'known':known, 'total':total}
+    def summoner_progress(self, summoner_id, version=0):
+        """Long-poll for the summoner's match loading progress newer than the given version."""
+        return self.summoner_progress_tracker.wait(int(summoner_id), int(version))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def summoner_queue_status(self):
+        return self.summoner_queue.status()
 
     @cherrypy.expose
     def summoner_content(self, summoner_id):
         summoner_id = int(summoner_id)
-        matchlist = self.api.matchlist(summoner_id)
-        matches = self.matches(summoner_id, matchlist)
-        teams = self.teams(summoner_id, matches)
+        matchlist = self.riot_call(self.api.matchlist_async, summoner_id)
+        try:
+            # fetch any missing matches in parallel, render with whatever has landed if this takes too long
+            self.client.call(self.api.matches_async, [m['matchId'] for m in matchlist])
+        except concurrent.futures.TimeoutError:
+            SUMMONER_FETCH_TIMEOUTS.inc()
+            cherrypy.log('Rendering summoner %d before all matches were fetched' % summoner_id)
+        stats = self.summoner_stats.update(summoner_id, matchlist)
+        teams = self.teams(summoner_id, stats)
         return self.html('summoner_content.html', teams=teams)
 
-    def matches(self, summoner_id, matchlist):
-        summoner_cache = {}
-        champion_cache = {}
-        matches = []
-        for m in matchlist:
-            match_id = m['matchId']
-            if match_id is None:
-                continue # skip bogus matches
-            match = self.api.match(match_id)
-            if match is None:
-                continue # skip matches that don't exist
-            matches.append(Match(self.api, match_id, summoner_id, match, summoner_cache, champion_cache))
-        return matches
-
-    def teams(self, summoner_id, matches, game_min=10):
+    def teams(self, summoner_id, stats, game_min=10):
+        groups, names = stats.snapshot()
+
         # compute counts of how many games this summoner has played with teammates
         match_counts = {}
-        for match in matches:
-            for teammate in match.teammates:
-                match_counts[teammate] = match_counts.get(teammate, 0) + 1
+        for members, group in groups:
+            for teammate in members:
+                match_counts[teammate] = match_counts.get(teammate, 0) + group['matches']
+        summoners = {sid: Summoner(sid, names.get(sid)) for sid in match_counts}
 
         # determine set of recurring teammates, anyone with N or more matches
-        recurring = set(s for (s, count) in match_counts.items() if s.summoner_id == summoner_id or count >= game_min)
+        recurring = set(summoners[sid] for (sid, count) in match_counts.items() if sid == summoner_id or count >= game_min)
 
         # return all iterations of recurring teammate combinations that include the summoner
-        solo_team = set(s for (s, count) in match_counts.items() if s.summoner_id == summoner_id)
+        solo_team = set(summoners[sid] for sid in match_counts if sid == summoner_id)
         teams = []
         if len(recurring) > 1:
             teams.append(Team(solo_team, recurring.difference(solo_team))) # special team to capture *only* solo games
@@ -266,76 +321,108 @@ class Lolfu:
                 if summoner_id in (s.summoner_id for s in teammates):
                     teams.append(Team(teammates, set()))
 
-        self.populate_team_stats(matches, teams)
+        self.populate_team_stats(groups, summoners, recurring, teams, game_min)
 
         return sorted([t for t in teams if t.match_count > game_min], key=operator.attrgetter('match_count'), reverse=True)
 
-    def populate_team_stats(self, matches, teams):
-        for match in matches:
-            if match.victory is None:
+    # largest number of recurring teammates to sum team stats with a dense zeta transform
+    ZETA_MAX_BITS = 12
+
+    def populate_team_stats(self, groups, summoners, recurring, teams, game_min=0):
+        # map recurring teammates to bits, everyone else can't affect team membership
+        bits = {s.summoner_id: 1 << i for (i, s) in enumerate(recurring)}
+        for team in teams:
+            team.mask = sum(bits[s.summoner_id] for s in team.summoners)
+            team.anti_mask = sum(bits[s.summoner_id] for s in team.anti_summoners)
+
+        # group counts by exact mask of recurring teammates
+        mask_groups = {}
+        for members, group in groups:
+            wins = group['wins']
+            losses = group['losses']
+            if not wins and not losses:
                 continue # skip inscrutable victory conditions
-            for summoner in match.teammates:
-                summoner.victory(match.victory)
+            for sid in members:
+                summoners[sid].tally(wins, losses)
+            mask = sum(bits.get(sid, 0) for sid in members)
+            totals = mask_groups.setdefault(mask, [0, 0, []])
+            totals[0] += wins
+            totals[1] += losses
+            totals[2].append(group)
+
+        # team wins and losses, a subset sum over supersets of each team's mask
+        n = len(bits)
+        if n <= self.ZETA_MAX_BITS:
+            wins = [0] * (1 << n)
+            losses = [0] * (1 << n)
+            for mask, (w, l, mgroups) in mask_groups.items():
+                wins[mask] = w
+                losses[mask] = l
+            for i in range(n):
+                bit = 1 << i
+                for mask in range(1 << n):
+                    if not mask & bit:
+                        wins[mask] += wins[mask | bit]
+                        losses[mask] += losses[mask | bit]
             for team in teams:
-                # only accumulate stats if this team played this match
-                if team.summoners.issubset(match.teammates) and not team.anti_summoners.intersection(match.teammates):
-                    team.victory(match.victory)
-                    for summoner in team.summoners:
-                        sid = summoner.summoner_id
-                        position = match.positions[sid]
-                        champion = match.champions[sid]
-                        if summoner and position and champion: # skip when data is uncertain
-                            team.summoner_champion_position(summoner, position, champion, match.victory)
+                if not team.anti_mask:
+                    team.tally(wins[team.mask], losses[team.mask])
+        for team in teams:
+            if team.anti_mask or n > self.ZETA_MAX_BITS:
+                for mask, (w, l, mgroups) in mask_groups.items():
+                    if mask & team.mask == team.mask and not mask & team.anti_mask:
+                        team.tally(w, l)
+
+        # summoner position champion stats, only for teams that will be shown
+        champion_cache = {}
+        for team in teams:
+            if team.match_count <= game_min:
+                continue
+            ids = set(s.summoner_id for s in team.summoners)
+            for mask, (w, l, mgroups) in mask_groups.items():
+                # only accumulate stats if this team played these matches
+                if mask & team.mask != team.mask or mask & team.anti_mask:
+                    continue
+                for group in mgroups:
+                    for (sid, position, champion_id), (w, l) in group['spc'].items():
+                        if sid in ids:
+                            champion = champion_cache.get(champion_id)
+                            if champion is None:
+                                champion = champion_cache[champion_id] = Champion(self.api, champion_id)
+                            team.summoner_champion_position(summoners[sid], position, champion, w, l)
 
 
 class Match:
 
-    def __init__(self, api, match_id, summoner_id, api_dict, summoner_cache, champion_cache):
+    def __init__(self, api, match_id, summoner_id, table, row, summoner_cache, champion_cache):
         self.match_id = match_id
 
-        # map participants to summoners
-        summoner_ids = {}
-        summoner_names = {}
-        for pid in api_dict['participantIdentities']:
-            sid = pid['player']['summonerId']
-            summoner_ids[pid['participantId']] = sid
-            summoner_names[sid] = pid['player']['summonerName']
-
-        # map participants to teams, champions, and positions
+        # scan participant columns for teams, champions, and positions
+        participants = table.participants(row)
         teams = {}
         champions = {}
         positions = {}
-        # determine victory
+        for sid, team_id, cid, position in participants:
+            teams[sid] = team_id
+            champions[sid] = champion_cache.setdefault(cid, Champion(api, cid))
+            positions[sid] = position
+
+        # calculate which team is this summoner's team and determine victory
+        teammate_team_id = teams.get(summoner_id)
+        winner_team_id = table.winners[row]
         self.victory = None
-        for p in api_dict['participants']:
-            pid = p['participantId']
-            # participants to teams
-            teams[pid] = p['teamId']
-            # who won?
-            if summoner_id == summoner_ids[pid]:
-                self.victory = p['stats']['winner']
-            # participants to champions
-            cid = p['championId']
-            champions[pid] = champion_cache.setdefault(cid, Champion(api, cid))
-            # participants to positions
-            # FIXME: "timeline" field always returned?
-            positions[pid] = riot.position(p['timeline']['lane'], p['timeline']['role'])
-
-        # calculate which team is this summoner's team
-        teammate_team_id = None
-        for pid, sid in summoner_ids.items():
-            if sid == summoner_id:
-                teammate_team_id = teams[pid]
+        if teammate_team_id is not None and winner_team_id:
+            self.victory = teammate_team_id == winner_team_id
 
         # calculate teammates for this match, include oneself
         self.teammates = set(
-            summoner_cache.setdefault(sid, Summoner(sid, summoner_names[sid]))
-            for (pid, sid) in summoner_ids.items()
-            if teammate_team_id is not None and teams[pid] == teammate_team_id)
+            summoner_cache.setdefault(sid, Summoner(sid, table.names.get(sid)))
+            for (sid, team_id) in teams.items()
+            if teammate_team_id is not None and team_id == teammate_team_id)
 
         # remember champions and positions for teammates
-        self.champions = {sid:champions[pid] for (pid, sid) in summoner_ids.items()}
-        self.positions = {sid:positions[pid] for (pid, sid) in summoner_ids.items()}
+        self.champions = champions
+        self.positions = positions
 
     def __eq__(self, other):
         return self.match_id == other.match_id
@@ -391,6 +478,10 @@ class Winrate:
         else:
             self.losses += 1
 
+    def tally(self, wins, losses):
+        self.wins += wins
+        self.losses += losses
+
 
 class Summoner(Winrate):
 
@@ -441,9 +532,9 @@ class Team(Winrate):
     def summoner_position_champions(self):
         return sorted(self.spc.values(), key=operator.attrgetter('match_count', 'winrate_expected'), reverse=True)
 
-    def summoner_champion_position(self, summoner, position, champion, victory):
+    def summoner_champion_position(self, summoner, position, champion, wins, losses):
         key = (summoner, position, champion)
-        self.spc.setdefault(key, SummonerPositionChampion(summoner, position, champion)).victory(victory)
+        self.spc.setdefault(key, SummonerPositionChampion(summoner, position, champion)).tally(wins, losses)
 
 
 class SummonerPositionChampion(Winrate):
@@ -455,33 +546,377 @@ class SummonerPositionChampion(Winrate):
         self.champion = champion
 
 
-class DataCollectorThread(threading.Thread):
+class StatsTables:
+    """Snapshot of every stats table the site serves. Snapshots are never
+    modified, a reload builds a new one and swaps it in with one assignment
+    so in-flight requests never see a half-built table.
+    """
+
+    MATCHUP_STATS = 'matchup_stats.csv'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.signature = self.current_signature(directory)
+        self.kill_stats = winstats.load_table(directory, winstats.KILL_STATS)
+        self.tower_stats = winstats.load_table(directory, winstats.TOWER_STATS)
+        self.joint_stats = winstats.load_table(directory, winstats.JOINT_STATS)
+        self._version = None
+        # the matchup matrix is built on first use to keep startup fast
+        self._matchup_matrix = None
+        self.matchup_lock = threading.Lock()
+
+    @classmethod
+    def current_signature(cls, directory):
+        """Return the size and mtime of every file a snapshot could be loaded from."""
+        signature = []
+        names = [name + ext for (name, ndim, caps) in (winstats.KILL_STATS, winstats.TOWER_STATS, winstats.JOINT_STATS)
+            for ext in ('.dat', '.csv')]
+        for name in names + [cls.MATCHUP_STATS]:
+            try:
+                st = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            signature.append((name, st.st_size, st.st_mtime_ns))
+        return tuple(signature)
+
+    @property
+    def version(self):
+        """Version of the served stats so clients can cache lookups against them."""
+        if self._version is None:
+            version = hashlib.sha1()
+            for table in (self.kill_stats, self.tower_stats, self.joint_stats):
+                table.wins # verify the payload first, a corrupt one is replaced by its fallback's source
+                version.update(repr(table.source).encode('utf-8'))
+            self._version = version.hexdigest()
+        return self._version
+
+    @property
+    def matchup_matrix(self):
+        if self._matchup_matrix is None:
+            with self.matchup_lock:
+                if self._matchup_matrix is None:
+                    self._matchup_matrix = pool.MatchupMatrix.from_csv(os.path.join(self.directory, self.MATCHUP_STATS))
+        return self._matchup_matrix
+
+    def warm(self):
+        """Build and verify everything up front, so corrupt artifacts fall back to their CSV exports here."""
+        self.matchup_matrix
+        for table in (self.kill_stats, self.tower_stats, self.joint_stats):
+            table.wins
+
+
+class StatsReloaderThread(threading.Thread):
+    """Watches the stats files and swaps a freshly loaded StatsTables into the app when they change."""
+
+    INTERVAL = 10 # seconds between checks
 
-    def __init__(self, api, summoner_queue):
-        super(DataCollectorThread, self).__init__(name='DataCollector', daemon=True)
+    def __init__(self, app, directory):
+        super(StatsReloaderThread, self).__init__(name='StatsReloader', daemon=True)
+        self.app = app
+        self.directory = directory
+
+    def run(self):
+        while True:
+            time.sleep(self.INTERVAL)
+            if StatsTables.current_signature(self.directory) == self.app.tables.signature:
+                continue
+            try:
+                tables = StatsTables(self.directory)
+                tables.warm()
+            except Exception as e:
+                print('...stats reload error', repr(str(e)))
+                continue
+            self.app.tables = tables
+            cherrypy.log('Reloaded stats tables version %s' % tables.version)
+
+
+class SummonerStats:
+    """Running totals of a summoner's matches grouped by the exact set of
+    teammates played with. Any team's stats are a sum over these groups, so
+    new matches fold in incrementally without revisiting old ones.
+    """
+
+    def __init__(self, summoner_id, state=None):
+        self.lock = threading.Lock()
+        self.summoner_id = summoner_id
+        self.match_ids = set()
+        self.last_match_id = None
+        self.names = {}
+        self.groups = {} # frozenset of teammate summoner ids -> totals
+        if state:
+            self.match_ids = state['match_ids']
+            self.last_match_id = state['last_match_id']
+            self.names = state['names']
+            self.groups = state['groups']
+
+    def state(self):
+        return {
+            'match_ids': self.match_ids,
+            'last_match_id': self.last_match_id,
+            'names': self.names,
+            'groups': self.groups,
+        }
+
+    def snapshot(self):
+        """Return copies of the groups and names that stay consistent while new matches fold in."""
+        with self.lock:
+            groups = [(members, dict(group, spc={key: tuple(tally) for (key, tally) in group['spc'].items()}))
+                for (members, group) in self.groups.items()]
+            return groups, dict(self.names)
+
+    def add(self, match):
+        members = frozenset(s.summoner_id for s in match.teammates)
+        group = self.groups.setdefault(members, {'matches': 0, 'wins': 0, 'losses': 0, 'spc': {}})
+        group['matches'] += 1
+        for summoner in match.teammates:
+            self.names[summoner.summoner_id] = summoner.name
+        if match.victory is not None:
+            group['wins' if match.victory else 'losses'] += 1
+            for sid in members:
+                position = match.positions[sid]
+                champion = match.champions[sid]
+                if position and champion: # skip when data is uncertain
+                    tally = group['spc'].setdefault((sid, position, champion.champion_id), [0, 0])
+                    tally[0 if match.victory else 1] += 1
+        self.match_ids.add(match.match_id)
+        self.last_match_id = match.match_id
+
+
+class SummonerStatsStore:
+    """Persisted SummonerStats for each summoner, kept current as matches are fetched."""
+
+    MAX_CACHED = 1000 # summoners whose stats are kept in memory
+
+    def __init__(self, api, directory):
         self.api = api
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.cache = cachetools.LRUCache(maxsize=self.MAX_CACHED)
+
+    def path(self, summoner_id):
+        return os.path.join(self.directory, '%d.dat' % summoner_id)
+
+    def get(self, summoner_id):
+        with self.lock:
+            stats = self.cache.get(summoner_id)
+            metrics.cache_lookup('summoner_stats', stats is not None)
+            if stats is None:
+                stats = self.cache[summoner_id] = SummonerStats(summoner_id, checkpoint.load(self.path(summoner_id)))
+            return stats
+
+    def update(self, summoner_id, matchlist):
+        """Fold any stored matches in the matchlist not yet seen into the summoner's stats and return them."""
+        stats = self.get(summoner_id)
+        # rows are only needed until each match is folded in, so the table lives for this update
+        table = matchtable.MatchTable()
+        summoner_cache = {}
+        champion_cache = {}
+        with stats.lock:
+            added = 0
+            for m in matchlist:
+                match_id = m['matchId']
+                if match_id is None or match_id in stats.match_ids:
+                    continue # skip bogus and already counted matches
+                match = self.api.stored_match(match_id) # never block on the Riot API here
+                row = table.add(match) if match is not None else None
+                if row is None:
+                    continue # skip matches that don't exist
+                stats.add(Match(self.api, match_id, summoner_id, table, row, summoner_cache, champion_cache))
+                added += 1
+            if added:
+                checkpoint.save(self.path(summoner_id), stats.state())
+        return stats
+
+
+class SummonerQueue:
+    """Durable, deduplicating priority queue of summoners whose data should be
+    collected. Summoners whose pages are open are served before background
+    refreshes, and anything unfinished is reloaded as a refresh on restart.
+    Changes are saved at most every SAVE_SECONDS by the data collector.
+    """
+
+    PAGE = 0
+    REFRESH = 1
+    SAVE_SECONDS = 5
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.heap = []
+        self.pending = {} # summoner_id -> (priority, enqueued)
+        self.in_progress = {} # summoner_id -> enqueued
+        self.counter = itertools.count()
+        self.lag = 0.0 # seconds the most recently started summoner waited in the queue
+        self.dirty = False
+        self.loop = None
+        self.wakeup = None
+        for summoner_id, enqueued in (checkpoint.load(path) or {}).items():
+            self._push(summoner_id, self.REFRESH, enqueued)
+
+    def _push(self, summoner_id, priority, enqueued):
+        self.pending[summoner_id] = (priority, enqueued)
+        heapq.heappush(self.heap, (priority, enqueued, next(self.counter), summoner_id))
+
+    def save(self):
+        """Persist the queue if it changed since the last save."""
+        with self.lock:
+            if not self.dirty:
+                return
+            state = {summoner_id: enqueued for (summoner_id, (priority, enqueued)) in self.pending.items()}
+            state.update(self.in_progress)
+            self.dirty = False
+        checkpoint.save(self.path, state)
+
+    def put(self, summoner_id, priority=REFRESH):
+        """Queue the summoner unless already queued at the same or a more urgent priority."""
+        with self.lock:
+            current = self.pending.get(summoner_id)
+            if current is not None and current[0] <= priority:
+                return
+            self._push(summoner_id, priority, current[1] if current else time.time())
+            self.dirty = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def pop(self):
+        """Return the most urgent queued summoner or None if nothing is queued."""
+        with self.lock:
+            while self.heap:
+                priority, enqueued, count, summoner_id = heapq.heappop(self.heap)
+                if self.pending.get(summoner_id) != (priority, enqueued):
+                    continue # superseded by a more urgent entry
+                del self.pending[summoner_id]
+                self.in_progress[summoner_id] = enqueued
+                self.lag = time.time() - enqueued
+                return summoner_id
+            return None
+
+    def done(self, summoner_id):
+        with self.lock:
+            self.in_progress.pop(summoner_id, None)
+            self.dirty = True
+
+    @asyncio.coroutine
+    def get(self):
+        """Wait within a coroutine for the most urgent queued summoner."""
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+            self.loop = asyncio.get_event_loop()
+        while True:
+            summoner_id = self.pop()
+            if summoner_id is not None:
+                return summoner_id
+            self.wakeup.clear()
+            yield from self.wakeup.wait()
+
+    def status(self):
+        """Return queue depth and lag in seconds."""
+        with self.lock:
+            now = time.time()
+            oldest = min([enqueued for (priority, enqueued) in self.pending.values()] or [now])
+            return {
+                'depth': len(self.pending),
+                'page_depth': sum(1 for (priority, enqueued) in self.pending.values() if priority == self.PAGE),
+                'in_progress': len(self.in_progress),
+                'oldest_lag': now - oldest,
+                'last_lag': self.lag,
+            }
+
+
+class SummonerProgress:
+    """In-memory match loading progress of each summoner, fed by the data
+    collector and waited on by long-polling page requests.
+    """
+
+    # longest a poll waits before returning unchanged progress; every loading summoner
+    # page holds a server thread while it polls, so --thread-pool caps how many can load at once
+    POLL_SECONDS = 15
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.progress = cachetools.TTLCache(maxsize=10000, ttl=3600) # summoner_id -> progress dict
+
+    def _set(self, summoner_id, **kw):
+        with self.condition:
+            progress = dict(self.progress.get(summoner_id) or {'known': 0, 'total': 0, 'done': False, 'version': 0})
+            progress.update(kw)
+            progress['version'] += 1
+            self.progress[summoner_id] = progress
+            self.condition.notify_all()
+
+    def start(self, summoner_id):
+        self._set(summoner_id, done=False)
+
+    def update(self, summoner_id, known, total):
+        self._set(summoner_id, known=known, total=total)
+
+    def finish(self, summoner_id):
+        self._set(summoner_id, done=True)
+
+    def wait(self, summoner_id, version):
+        """Return the summoner's progress once it is newer than version, or as is after POLL_SECONDS."""
+        deadline = time.time() + self.POLL_SECONDS
+        with self.condition:
+            while True:
+                progress = self.progress.get(summoner_id)
+                if progress is not None and progress['version'] > version:
+                    return progress
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return progress or {'known': 0, 'total': 0, 'done': False, 'version': version}
+                self.condition.wait(remaining)
+
+
+class DataCollector:
+    """Pool of worker coroutines on the shared background loop that collect
+    queued summoners' matches and fold them into their stats.
+    """
+
+    WORKERS = 4
+
+    def __init__(self, api, client, summoner_stats, summoner_queue, summoner_progress):
+        self.api = api
+        self.client = client
+        self.summoner_stats = summoner_stats
         self.summoner_queue = summoner_queue
+        self.summoner_progress = summoner_progress
+
+    def start(self):
+        for i in range(self.WORKERS):
+            self.client.submit(self.worker)
+        self.client.submit(self.saver)
 
     @asyncio.coroutine
-    def add_summoner(self, session, summoner_id):
-        matchlist = self.api.matchlist(summoner_id)
-        yield from asyncio.wait([self.api.match_async(session, m['matchId']) for m in matchlist if m])
+    def saver(self, session):
+        """Periodically persist the summoner queue, syncing to disk off the event loop."""
+        while True:
+            yield from asyncio.sleep(self.summoner_queue.SAVE_SECONDS)
+            try:
+                yield from asyncio.get_event_loop().run_in_executor(None, self.summoner_queue.save)
+            except Exception as e:
+                print('...summoner queue save error', repr(str(e)))
 
-    def process_summoner(self, summoner_id):
-        session = riot.ClientSession()
-        try:
-            asyncio.get_event_loop().run_until_complete(self.add_summoner(session, summoner_id))
-        finally:
-            session.close()
+    @asyncio.coroutine
+    def add_summoner(self, session, summoner_id):
+        matchlist = yield from self.api.matchlist_async(session, summoner_id)
+        yield from self.api.matches_async(session, [m['matchId'] for m in matchlist],
+            functools.partial(self.summoner_progress.update, summoner_id))
+        # folding stats touches disk, keep it off the event loop
+        yield from asyncio.get_event_loop().run_in_executor(None, self.summoner_stats.update, summoner_id, matchlist)
 
-    def run(self):
+    @asyncio.coroutine
+    def worker(self, session):
         while True:
-            summoner_id = self.summoner_queue.get()
+            summoner_id = yield from self.summoner_queue.get()
+            self.summoner_progress.start(summoner_id)
             try:
-                self.process_summoner(summoner_id)
+                yield from self.add_summoner(session, summoner_id)
             except Exception as e:
                 print('...summoner_id', summoner_id, 'error', repr(str(e)))
-            self.summoner_queue.task_done()
+            finally:
+                self.summoner_queue.done(summoner_id)
+                self.summoner_progress.finish(summoner_id)
 
 
 if __name__ == '__main__':
@@ -494,6 +929,8 @@ if __name__ == '__main__':
         help='What hostname should we listen on?')
     parser.add_argument('--port', metavar='PORT', type=int, default=8080,
         help='What port should we listen on?')
+    parser.add_argument('--thread-pool', metavar='THREADS', type=int, default=30,
+        help='How many requests can we serve at once? Each loading summoner page holds one.')
     parser.add_argument('--access-log', default=None,
         help='What file should we write access logs to?')
     parser.add_argument('--error-log', default=None,
@@ -504,6 +941,7 @@ if __name__ == '__main__':
     global_cfg = {
         'server.socket_host': args.host,
         'server.socket_port': args.port,
+        'server.thread_pool': args.thread_pool, # must exceed the summoner pages loading at once
         'log.access_file': args.access_log,
         'log.error_file': args.error_log,
     }
@@ -0,0 +1,102 @@
+"""Round-trip and corruption tests for the packed match store."""
+
+import matchstore
+import os
+import os.path
+
+
+def match(match_id):
+    return {'matchId': match_id, 'participants': [{'participantId': 1, 'championId': match_id % 130}]}
+
+
+def test_round_trip(tmpdir):
+    directory = str(tmpdir)
+    store = matchstore.MatchStore(directory)
+    for match_id in range(1, 101):
+        store.put(match_id, match(match_id))
+    store.put(1, {'matchId': 'ignored'}) # already stored
+    assert len(store) == 100
+    assert store.get(1) == match(1)
+    assert store.get(1000) is None
+    assert 1000 not in store
+    store.close()
+
+    store = matchstore.MatchStore(directory)
+    try:
+        assert len(store) == 100
+        assert sorted(store.match_ids()) == list(range(1, 101))
+        for match_id in range(1, 101):
+            assert match_id in store
+            assert store.get(match_id) == match(match_id)
+    finally:
+        store.close()
+
+
+def test_sees_other_writers(tmpdir):
+    directory = str(tmpdir)
+    reader = matchstore.MatchStore(directory)
+    writer = matchstore.MatchStore(directory)
+    try:
+        writer.put(7, match(7))
+        assert 7 in reader
+        assert reader.get(7) == match(7)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_segment_rollover(tmpdir, monkeypatch):
+    monkeypatch.setattr(matchstore, 'SEGMENT_SIZE', 200)
+    directory = str(tmpdir)
+    store = matchstore.MatchStore(directory)
+    for match_id in range(1, 21):
+        store.put(match_id, match(match_id))
+    assert store.segment > 0
+    store.close()
+
+    assert os.path.exists(os.path.join(directory, matchstore.SEGMENT_FILE % store.segment))
+    store = matchstore.MatchStore(directory)
+    try:
+        for match_id in range(1, 21):
+            assert store.get(match_id) == match(match_id)
+    finally:
+        store.close()
+
+
+def test_partial_index_entry(tmpdir):
+    directory = str(tmpdir)
+    store = matchstore.MatchStore(directory)
+    store.put(1, match(1))
+    store.close()
+
+    # a writer that crashed midway through an index entry
+    with open(os.path.join(directory, matchstore.INDEX_FILE), 'ab') as f:
+        f.write(matchstore.INDEX_ENTRY.pack(2, 0, 0, 0)[:5])
+
+    store = matchstore.MatchStore(directory)
+    assert len(store) == 1
+    assert store.get(1) == match(1)
+    store.put(3, match(3))
+    store.close()
+
+    assert os.path.getsize(os.path.join(directory, matchstore.INDEX_FILE)) == 2 * matchstore.INDEX_ENTRY.size
+    store = matchstore.MatchStore(directory)
+    try:
+        assert sorted(store.match_ids()) == [1, 3]
+        assert store.get(1) == match(1)
+        assert store.get(3) == match(3)
+    finally:
+        store.close()
+
+
+def test_migrate(tmpdir):
+    cache_dir = tmpdir.mkdir('match')
+    cache_dir.mkdir('1').join('11.dat').write('{"matchId": 11}')
+    cache_dir.join('12.dat').write('{"matchId": ') # truncated legacy file
+    store = matchstore.MatchStore(str(tmpdir.join('store')))
+    try:
+        assert matchstore.migrate(str(cache_dir), store) == 1
+        assert store.get(11) == {'matchId': 11}
+        assert 12 not in store
+    finally:
+        store.close()
@@ -0,0 +1,118 @@
+"""Checks the bitmask team stats in site.py against a brute force tally of every group."""
+
+import importlib.machinery
+import itertools
+import os.path
+import pytest
+import random
+
+
+FOCUS_ID = 1
+POSITIONS = ('TOP', 'JUNGLE', 'MIDDLE', 'ADC', 'SUPPORT')
+
+
+@pytest.fixture(scope='module')
+def site():
+    for name in ('aiohttp', 'cachetools', 'cherrypy', 'mako', 'requests'):
+        pytest.importorskip(name)
+    # stdlib's site module shadows site.py under its own name
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'site.py')
+    return importlib.machinery.SourceFileLoader('lolfu_site', path).load_module()
+
+
+class FakeAPI:
+
+    def champion_image(self, champion_id):
+        return '%d.png' % champion_id
+
+    def champion_name(self, champion_id):
+        return 'Champion %d' % champion_id
+
+    def champion_key(self, champion_id):
+        return 'Champion%d' % champion_id
+
+
+def make_groups(recurring, others, count, rnd):
+    """Return snapshot groups of the focus summoner playing with random teammates."""
+    groups = {}
+    for i in range(count):
+        members = set([FOCUS_ID])
+        members.update(rnd.sample(recurring, rnd.randrange(0, min(len(recurring), 4) + 1)))
+        while len(members) < 5:
+            members.add(rnd.choice(others))
+        group = groups.setdefault(frozenset(members), {'matches': 0, 'wins': 0, 'losses': 0, 'spc': {}})
+        group['matches'] += 1
+        if not rnd.randrange(10):
+            continue # inscrutable victory conditions
+        victory = rnd.random() < 0.5
+        group['wins' if victory else 'losses'] += 1
+        for sid, position in zip(members, rnd.sample(POSITIONS, len(members))):
+            tally = group['spc'].setdefault((sid, position, rnd.randrange(1, 20)), [0, 0])
+            tally[0 if victory else 1] += 1
+    return [(members, dict(group, spc={key: tuple(tally) for (key, tally) in group['spc'].items()}))
+        for (members, group) in groups.items()]
+
+
+def make_teams(site, summoners, recurring):
+    """Return every team the summoner page shows, as Lolfu.teams builds them."""
+    solo_team = set([summoners[FOCUS_ID]])
+    teams = [site.Team(solo_team, recurring.difference(solo_team))]
+    for i in (1, 2, 3, 4, 5):
+        for teammates in itertools.combinations(recurring, i):
+            if FOCUS_ID in (s.summoner_id for s in teammates):
+                teams.append(site.Team(teammates, set()))
+    return teams
+
+
+def baseline(groups, teams):
+    """Return the wins, losses and champion stats of each team by testing every group against it."""
+    results = []
+    for team in teams:
+        ids = set(s.summoner_id for s in team.summoners)
+        anti_ids = set(s.summoner_id for s in team.anti_summoners)
+        wins = losses = 0
+        spc = {}
+        for members, group in groups:
+            if not group['wins'] and not group['losses']:
+                continue
+            if ids.issubset(members) and not anti_ids.intersection(members):
+                wins += group['wins']
+                losses += group['losses']
+                for (sid, position, champion_id), (w, l) in group['spc'].items():
+                    if sid in ids:
+                        tally = spc.setdefault((sid, position, champion_id), [0, 0])
+                        tally[0] += w
+                        tally[1] += l
+        results.append((wins, losses, {key: tuple(tally) for (key, tally) in spc.items()}))
+    return results
+
+
+def results(teams):
+    return [(team.wins, team.losses,
+        {(s.summoner.summoner_id, s.position, s.champion.champion_id): (s.wins, s.losses) for s in team.spc.values()})
+        for team in teams]
+
+
+@pytest.mark.parametrize('recurring_count', [1, 4, 8])
+@pytest.mark.parametrize('zeta_max_bits', [12, 0])
+def test_populate_team_stats_matches_baseline(site, recurring_count, zeta_max_bits):
+    rnd = random.Random(recurring_count)
+    recurring_ids = list(range(100, 100 + recurring_count))
+    other_ids = list(range(1000, 1040))
+    groups = make_groups(recurring_ids, other_ids, 2000, rnd)
+
+    summoners = {}
+    for members, group in groups:
+        for sid in members:
+            summoners.setdefault(sid, site.Summoner(sid, 'Summoner %d' % sid))
+    recurring = set(summoners[sid] for sid in [FOCUS_ID] + recurring_ids if sid in summoners)
+    teams = make_teams(site, summoners, recurring)
+
+    app = site.Lolfu.__new__(site.Lolfu)
+    app.api = FakeAPI()
+    app.ZETA_MAX_BITS = zeta_max_bits # 0 forces the per-team scan used for large rosters
+    app.populate_team_stats(groups, summoners, recurring, teams)
+
+    assert results(teams) == baseline(groups, teams)
+    focus = summoners[FOCUS_ID]
+    assert (focus.wins, focus.losses) == (sum(g['wins'] for (m, g) in groups), sum(g['losses'] for (m, g) in groups))
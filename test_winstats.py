@@ -0,0 +1,121 @@
+"""Round-trip and corruption tests for the binary win tables."""
+
+import csv
+import os.path
+import pytest
+import winstats
+
+
+KILLS_WON = {(0, 0): 50, (3, 1): 120, (1, 5): 10}
+KILLS_LOST = {(0, 0): 50, (3, 1): 40, (1, 5): 90, (2, 2): 7}
+
+
+def write_csv(directory, name, winner_stats, loser_stats):
+    """Write a crawler CSV export of the given counts."""
+    with open(os.path.join(directory, name + '.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        for key in sorted(set(winner_stats) | set(loser_stats)):
+            writer.writerow([winner_stats.get(key, 0), loser_stats.get(key, 0)] + list(key))
+
+
+def assert_counts(table, winner_stats, loser_stats):
+    for key in set(winner_stats) | set(loser_stats):
+        assert table.get(key) == (winner_stats.get(key, 0), loser_stats.get(key, 0))
+
+
+def test_round_trip(tmpdir):
+    directory = str(tmpdir)
+    winstats.save_table(directory, winstats.KILL_STATS, KILLS_WON, KILLS_LOST)
+    table = winstats.load_table(directory, winstats.KILL_STATS)
+    assert table.source[0] == os.path.join(directory, 'kill_stats.dat')
+    assert table.generation
+    assert table.shape == (4, 6)
+    assert_counts(table, KILLS_WON, KILLS_LOST)
+    assert table.get((9, 9)) == (0, 0)
+    assert table.get((-1, 0)) == (0, 0)
+    assert table.estimate((3, 1)) == 0.75
+
+
+def test_capped_axes(tmpdir):
+    directory = str(tmpdir)
+    won = {(0, 0, 45, 0, 0, 1): 3, (0, 0, 40, 0, 0, 1): 2}
+    lost = {(0, 0, 1, 0, 0, 60): 4}
+    winstats.save_table(directory, winstats.JOINT_STATS, won, lost)
+    table = winstats.load_table(directory, winstats.JOINT_STATS)
+    assert table.shape == (1, 1, 41, 1, 1, 41)
+    assert table.get((0, 0, 40, 0, 0, 1)) == (5, 0)
+    assert table.get((0, 0, 99, 0, 0, 1)) == (5, 0)
+    assert table.get((0, 0, 1, 0, 0, 40)) == (0, 4)
+
+
+def test_corrupt_payload_falls_back_to_csv(tmpdir, capsys):
+    directory = str(tmpdir)
+    winstats.save_table(directory, winstats.KILL_STATS, KILLS_WON, KILLS_LOST)
+    write_csv(directory, 'kill_stats', KILLS_WON, KILLS_LOST)
+    path = os.path.join(directory, 'kill_stats.dat')
+    with open(path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\xff')
+
+    table = winstats.load_table(directory, winstats.KILL_STATS)
+    assert table.source[0] == path # verified lazily, on first use
+    assert_counts(table, KILLS_WON, KILLS_LOST)
+    assert table.source[0] == os.path.join(directory, 'kill_stats.csv')
+    assert 'is corrupt' in capsys.readouterr().err
+
+
+def test_corrupt_payload_without_csv(tmpdir):
+    directory = str(tmpdir)
+    winstats.save_table(directory, winstats.KILL_STATS, KILLS_WON, KILLS_LOST)
+    with open(os.path.join(directory, 'kill_stats.dat'), 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\xff')
+    table = winstats.load_table(directory, winstats.KILL_STATS)
+    assert table.get((3, 1)) == (0, 0)
+    assert table.source is None
+    with pytest.raises(ValueError):
+        corrupt = winstats.WinTable.load(os.path.join(directory, 'kill_stats.dat'))
+        corrupt.get((3, 1))
+
+
+@pytest.mark.parametrize('size', [0, winstats.HEADER.size - 1, winstats.HEADER.size + 4, -1])
+def test_truncated_artifact_falls_back_to_csv(tmpdir, size):
+    directory = str(tmpdir)
+    winstats.save_table(directory, winstats.KILL_STATS, KILLS_WON, KILLS_LOST)
+    write_csv(directory, 'kill_stats', KILLS_WON, KILLS_LOST)
+    path = os.path.join(directory, 'kill_stats.dat')
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:size])
+
+    with pytest.raises(ValueError):
+        winstats.WinTable.load(path)
+    table = winstats.load_table(directory, winstats.KILL_STATS)
+    assert table.source[0] == os.path.join(directory, 'kill_stats.csv')
+    assert_counts(table, KILLS_WON, KILLS_LOST)
+
+
+def test_unsupported_version(tmpdir):
+    path = str(tmpdir.join('kill_stats.dat'))
+    winstats.WinTable.from_counts(2, KILLS_WON, KILLS_LOST).save(path)
+    with open(path, 'r+b') as f:
+        f.seek(4)
+        f.write(b'\x01\x00')
+    with pytest.raises(ValueError):
+        winstats.WinTable.load(path)
+
+
+def test_replaced_artifact_keeps_original_mapping(tmpdir):
+    directory = str(tmpdir)
+    winstats.save_table(directory, winstats.KILL_STATS, KILLS_WON, KILLS_LOST)
+    table = winstats.load_table(directory, winstats.KILL_STATS)
+    winstats.save_table(directory, winstats.KILL_STATS, {(0, 0): 1}, {})
+    assert_counts(table, KILLS_WON, KILLS_LOST)
+
+
+def test_missing_table_is_empty(tmpdir):
+    table = winstats.load_table(str(tmpdir), winstats.TOWER_STATS)
+    assert table.source is None
+    assert table.get((0, 0, 0, 0)) == (0, 0)
+    assert table.estimate((0, 0, 0, 0)) is None
@@ -0,0 +1,268 @@
+"""Dense win/loss tables over game states.
+
+A game state is a tuple of small non-negative integers such as (your kills,
+their kills) or (your inhibitors, your towers, your kills, their inhibitors,
+their towers, their kills). Wins and losses for every state are held in flat
+row-major arrays so lookups are O(1), and low-sample states are smoothed
+toward the pooled winrate of their neighboring states.
+
+Tables are saved as versioned binary artifacts: a header carrying the format
+version, build generation and a CRC32 of the payload, then the shape, then the
+wins and losses as little-endian uint32s. Loading reads the header and maps
+the payload; its checksum is verified the first time the table is used, and a
+corrupt payload is replaced by the table's CSV export.
+"""
+
+import array
+import checkpoint
+import csv
+import functools
+import itertools
+import mmap
+import os
+import os.path
+import struct
+import sys
+import threading
+import time
+import zlib
+
+
+MAGIC = b'LFWT'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHHQI') # magic, format version, ndim, generation, payload crc32
+MIN_SAMPLES = 100 # states with fewer matches are smoothed toward their neighbors
+MAX_RADIUS = 2 # furthest neighbors to back off to
+
+# table names and dimensions, joint kills are capped to keep the dense table small
+KILL_STATS = ('kill_stats', 2, None)
+TOWER_STATS = ('tower_stats', 4, None)
+JOINT_STATS = ('joint_stats', 6, (None, None, 40, None, None, 40))
+
+
+class WinTable:
+    """Wins and losses for every state in a fixed shape. Axes may be capped,
+    in which case larger values are counted and looked up at the cap.
+    """
+
+    def __init__(self, shape, wins=None, losses=None, caps=None):
+        self.shape = tuple(shape)
+        self.caps = tuple(caps) if caps else (None, ) * len(self.shape)
+        self.size = 1
+        for dim in self.shape:
+            self.size *= dim
+        self.strides = []
+        stride = 1
+        for dim in reversed(self.shape):
+            self.strides.insert(0, stride)
+            stride *= dim
+        self._wins = wins if wins is not None else array.array('I', [0]) * self.size
+        self._losses = losses if losses is not None else array.array('I', [0]) * self.size
+        self.estimate = functools.lru_cache(maxsize=10000)(self._estimate)
+        self.source = None # (path, size, mtime) of the file this table was loaded from
+        self.generation = 0
+        self.mapping = None # (path, mapped payload, crc32) to verify lazily
+        self.fallback = None # returns a replacement table should the payload be corrupt
+        self.map_lock = threading.Lock()
+
+    def _map(self):
+        """Verify the mapped payload of a lazily loaded table, replacing it with the fallback if corrupt."""
+        with self.map_lock:
+            if self.mapping is None:
+                return
+            path, payload, crc = self.mapping
+            if zlib.crc32(payload) & 0xffffffff != crc:
+                if self.fallback is None:
+                    raise ValueError('%s is corrupt' % path)
+                table = self.fallback()
+                print('...', path, 'is corrupt, serving', table.source[0] if table.source else 'an empty table',
+                    'instead', file=sys.stderr)
+                self.source = table.source
+                self.shape, self.size, self.strides = table.shape, table.size, table.strides
+                self._wins, self._losses = table.wins, table.losses
+                self.mapping = None
+                return
+            if sys.byteorder == 'little':
+                wins = payload[:4 * self.size].cast('I')
+                losses = payload[4 * self.size:].cast('I')
+            else:
+                wins = array.array('I', payload[:4 * self.size])
+                wins.byteswap()
+                losses = array.array('I', payload[4 * self.size:])
+                losses.byteswap()
+            self._wins, self._losses = wins, losses
+            self.mapping = None
+
+    @property
+    def wins(self):
+        if self.mapping is not None:
+            self._map()
+        return self._wins
+
+    @property
+    def losses(self):
+        if self.mapping is not None:
+            self._map()
+        return self._losses
+
+    @classmethod
+    def from_counts(cls, ndim, winner_stats, loser_stats, caps=None):
+        """Build a table from dicts of state -> count for the winning and losing side."""
+        caps = caps or (None, ) * ndim
+        shape = [1] * ndim
+        for key in itertools.chain(winner_stats, loser_stats):
+            shape = [max(s, k + 1) for (s, k) in zip(shape, key)]
+        shape = [s if cap is None else min(s, cap + 1) for (s, cap) in zip(shape, caps)]
+        table = cls(shape, caps=caps)
+        for stats, counts in ((winner_stats, table._wins), (loser_stats, table._losses)):
+            for key, count in stats.items():
+                counts[table.offset(key)] += count
+        return table
+
+    @classmethod
+    def from_csv(cls, path, ndim, caps=None):
+        """Build a table from a crawler CSV export with wins, losses, then the state on each row."""
+        winner_stats = {}
+        loser_stats = {}
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                w, l = int(row[0]), int(row[1])
+                key = tuple(int(x) for x in row[2:])
+                winner_stats[key] = w
+                loser_stats[key] = l
+        return cls.from_counts(ndim, winner_stats, loser_stats, caps)
+
+    @classmethod
+    def load(cls, path, caps=None):
+        """Return a table mapped from the artifact at path, its payload verified on first use.
+        The file is mapped here so a newer artifact replacing it can't be mixed with this header.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                raise ValueError('%s is truncated' % path)
+            magic, version, ndim, generation, crc = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError('%s is not a win table' % path)
+            if version != FORMAT_VERSION:
+                raise ValueError('%s has unsupported format version %d' % (path, version))
+            dims = f.read(4 * ndim)
+            if len(dims) != 4 * ndim:
+                raise ValueError('%s is truncated' % path)
+            table = cls(struct.unpack('<%dI' % ndim, dims), array.array('I'), array.array('I'), caps)
+            offset = HEADER.size + 4 * ndim
+            if os.fstat(f.fileno()).st_size != offset + 8 * table.size:
+                raise ValueError('%s is truncated' % path)
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        table.generation = generation
+        table.mapping = (path, memoryview(m)[offset:], crc)
+        return table
+
+    def save(self, path):
+        wins = array.array('I', self.wins)
+        losses = array.array('I', self.losses)
+        if sys.byteorder != 'little':
+            wins.byteswap()
+            losses.byteswap()
+        payload = wins.tobytes() + losses.tobytes()
+        with checkpoint.atomic_open(path, 'wb') as f:
+            generation = int(time.time() * 1000000)
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(self.shape), generation, zlib.crc32(payload) & 0xffffffff))
+            f.write(struct.pack('<%dI' % len(self.shape), *self.shape))
+            f.write(payload)
+
+    def offset(self, key):
+        """Return the array offset of the given state or None if it lies outside the table."""
+        if self.mapping is not None:
+            self._map() # a corrupt payload's replacement may have another shape
+        if len(key) != len(self.shape):
+            return None
+        offset = 0
+        for k, dim, stride, cap in zip(key, self.shape, self.strides, self.caps):
+            if cap is not None and k > cap:
+                k = cap
+            if k < 0 or k >= dim:
+                return None
+            offset += k * stride
+        return offset
+
+    def get(self, key):
+        """Return the (wins, losses) observed for the given state."""
+        offset = self.offset(key)
+        if offset is None:
+            return (0, 0)
+        return (self.wins[offset], self.losses[offset])
+
+    def pooled(self, key, radius):
+        """Return the (wins, losses) summed over all states within radius of the given state."""
+        if self.mapping is not None:
+            self._map()
+        wins = 0
+        losses = 0
+        ranges = [range(max(0, k - radius), min(dim, k + radius + 1))
+            for (k, dim) in zip((min(k, dim - 1) for (k, dim) in zip(key, self.shape)), self.shape)]
+        for neighbor in itertools.product(*ranges):
+            offset = sum(k * stride for (k, stride) in zip(neighbor, self.strides))
+            wins += self.wins[offset]
+            losses += self.losses[offset]
+        return wins, losses
+
+    def _estimate(self, key):
+        """Return the smoothed winrate of the given state or None if nothing nearby was observed.
+
+        States with fewer than MIN_SAMPLES matches are padded out to MIN_SAMPLES
+        with the pooled winrate of their nearest neighborhood that has enough data.
+        """
+        key = tuple(key)
+        if len(key) != len(self.shape) or any(k < 0 for k in key):
+            return None
+        wins, losses = self.get(key)
+        n = wins + losses
+        if n >= MIN_SAMPLES:
+            return wins / n
+        prior = None
+        for radius in range(1, MAX_RADIUS + 1):
+            pooled_wins, pooled_losses = self.pooled(key, radius)
+            if pooled_wins + pooled_losses:
+                prior = pooled_wins / (pooled_wins + pooled_losses)
+            if pooled_wins + pooled_losses >= MIN_SAMPLES:
+                break
+        if prior is None:
+            return (wins / n) if n else None
+        k = MIN_SAMPLES - n
+        return (wins + k * prior) / (n + k)
+
+
+def load_table(directory, spec):
+    """Load the table described by spec from its binary artifact in directory,
+    falling back to its CSV export, or an empty table if neither exists.
+    """
+    name, ndim, caps = spec
+    path = os.path.join(directory, name + '.dat')
+
+    def from_csv():
+        path = os.path.join(directory, name + '.csv')
+        if os.path.exists(path):
+            st = os.stat(path)
+            table = WinTable.from_csv(path, ndim, caps)
+            table.source = (path, st.st_size, st.st_mtime_ns)
+            return table
+        return WinTable((1, ) * ndim, caps=caps)
+
+    if os.path.exists(path):
+        st = os.stat(path)
+        try:
+            table = WinTable.load(path, caps)
+        except ValueError:
+            pass # unreadable artifact, fall back to the CSV export
+        else:
+            table.source = (path, st.st_size, st.st_mtime_ns)
+            table.fallback = from_csv # should the payload turn out to be corrupt
+            return table
+    return from_csv()
+
+
+def save_table(directory, spec, winner_stats, loser_stats):
+    """Build the table described by spec from crawler counts and save its binary artifact in directory."""
+    name, ndim, caps = spec
+    WinTable.from_counts(ndim, winner_stats, loser_stats, caps).save(os.path.join(directory, name + '.dat'))